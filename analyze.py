@@ -0,0 +1,203 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import re
+import sys
+from collections import deque
+
+import engine
+import rules
+import transposition
+
+# Replays games from PGN files through the rules and writes one JSON line per game: whether
+# every move was legal, how the game ended on the board and, optionally, the engine's
+# evaluation after each move. Files are read one game at a time and only a few batches of games
+# are in flight at once, so archives of any size run in bounded memory.
+
+RESULTS = {'1-0', '0-1', '1/2-1/2', '*'}
+
+HEADER = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+
+#region Reading
+
+def readGames(lines):
+    # (headers, movetext) for each game of PGN text lines, as they are read
+    headers, movetext = {}, []
+    comment = 0
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('[') and not comment:
+            if movetext:
+                yield headers, ' '.join(movetext)
+                headers, movetext = {}, []
+            match = HEADER.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        if stripped.startswith('%'):
+            continue
+        if stripped:
+            movetext.append(stripped)
+            comment = max(0, comment + stripped.count('{') - stripped.count('}'))
+    if headers or movetext:
+        yield headers, ' '.join(movetext)
+
+def moveTokens(movetext):
+    # Moves of the main line, leaving out comments, variations, move numbers, annotations and
+    # the result
+    tokens = []
+    depth = 0
+    for token in re.sub(r'\{[^}]*\}|;[^\n]*', ' ', movetext).replace('(', ' ( ').replace(')', ' ) ').split():
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(0, depth - 1)
+        elif depth == 0:
+            token = MOVE_NUMBER.sub('', token)
+            if token and not token.startswith('$') and token not in RESULTS:
+                tokens.append(token)
+    return tokens
+
+#endregion
+
+#region Analysis
+
+def _evaluation(searcher, position, depth):
+    # Engine score after a fixed depth search, in centipawns for white, or moves to mate
+    # (negative when black mates)
+    if searcher.search(position, maxDepth=depth) == None:
+        return {'mate': 0} if position.inCheck() else {'score': 0}
+    score = searcher.score if position.sideToMove == rules.WHITE else -searcher.score
+    if abs(score) >= engine.MATE_BOUND:
+        plies = engine.MATE_SCORE - abs(score)
+        return {'mate': (plies + 1) // 2 if score > 0 else -((plies + 1) // 2)}
+    return {'score': score}
+
+def analyzeGame(headers, movetext, searcher=None, depth=None):
+    position = rules.Position.fromFen(headers['FEN']) if 'FEN' in headers else rules.Position.initial()
+    moves = []
+    error = None
+    for san in moveTokens(movetext):
+        move = position.parseSan(san)
+        record = {'ply': len(moves) + 1, 'san': san, 'legal': move != None}
+        moves.append(record)
+        if move == None:
+            error = f"Illegal move {san} at ply {len(moves)}"
+            break
+        position.push(move)
+        record['move'] = rules.moveName(move)
+        if searcher != None:
+            record.update(_evaluation(searcher, position, depth))
+
+    status = position.status()
+    result = headers.get('Result', '*')
+    if status == rules.Status.CHECKMATE:
+        expected = '0-1' if position.sideToMove == rules.WHITE else '1-0'
+    elif status in (rules.Status.STALEMATE, rules.Status.INSUFFICIENT_MATERIAL):
+        expected = '1/2-1/2'
+    else:
+        # Resignations, agreed draws, claims and time losses can't be checked from the moves
+        expected = None
+
+    analysis = {
+        'headers': headers,
+        'moves': moves,
+        'legal': error == None,
+        'result': result,
+        'status': status.name.lower(),
+        'checkmate': status == rules.Status.CHECKMATE,
+        'stalemate': status == rules.Status.STALEMATE,
+        'resultMatches': None if expected == None or error != None else result == expected,
+    }
+    if error != None:
+        analysis['error'] = error
+    return analysis
+
+# Search state of each pool process, set up once by _initProcess
+_searcher = None
+_depth = None
+
+def _initProcess(depth, tableMegabytes):
+    global _searcher, _depth
+    _depth = depth
+    if depth:
+        _searcher = engine.Engine(transposition.TranspositionTable(tableMegabytes))
+
+def _analyzeBatch(batch):
+    # (JSON line, whether the game was legal) of each game, encoded here rather than in the
+    # parent so the work is spread over the processes
+    lines = []
+    for index, headers, movetext in batch:
+        try:
+            analysis = {'game': index, **analyzeGame(headers, movetext, _searcher, _depth)}
+        except Exception as e:
+            # A broken game (like a bad FEN header) is reported rather than ending the run
+            analysis = {'game': index, 'headers': headers, 'legal': False, 'error': f"{type(e).__name__}: {e}"}
+        lines.append((json.dumps(analysis), analysis['legal']))
+    return lines
+
+def _batches(games, size):
+    games = ((index, headers, movetext) for index, (headers, movetext) in enumerate(games, 1))
+    while True:
+        batch = list(itertools.islice(games, size))
+        if not batch:
+            return
+        yield batch
+
+def analyzeBatches(batches, processes=1, depth=None, tableMegabytes=16):
+    # Lines of each batch in order (see _analyzeBatch). With more than one process at most a
+    # few batches per process are read ahead, unlike Pool.imap which reads all of its input
+    # up front.
+    if processes <= 1:
+        _initProcess(depth, tableMegabytes)
+        for batch in batches:
+            yield _analyzeBatch(batch)
+        return
+
+    with multiprocessing.get_context('spawn').Pool(processes, _initProcess, (depth, tableMegabytes)) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(_analyzeBatch, (batch,)))
+            if len(pending) >= processes * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+#endregion
+
+def _readFiles(paths):
+    for path in paths:
+        if path == '-':
+            yield from readGames(sys.stdin)
+        else:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                yield from readGames(f)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Check the games of PGN files and write one JSON line of analysis per game")
+    parser.add_argument('pgn', nargs='+', help="PGN files to read, - for standard input")
+    parser.add_argument('--output', help="file to write the JSON lines to (default: standard output)")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help="processes to analyze games with (default: one per core)")
+    parser.add_argument('--batch', type=int, default=16, help="games sent to a process at a time (default: 16)")
+    parser.add_argument('--depth', type=int, help="evaluate the position after every move with a search of this depth")
+    parser.add_argument('--hash', type=float, default=16, help="transposition table size per process in MB (default: 16)")
+    options = parser.parse_args(args)
+
+    output = open(options.output, 'w') if options.output else sys.stdout
+    games = illegal = 0
+    try:
+        for lines in analyzeBatches(_batches(_readFiles(options.pgn), options.batch), options.processes, options.depth, options.hash):
+            for line, legal in lines:
+                output.write(line + '\n')
+                games += 1
+                illegal += not legal
+    finally:
+        if output != sys.stdout:
+            output.close()
+    print(f"Analyzed {games} games, {illegal} with illegal moves or errors", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
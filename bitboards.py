@@ -0,0 +1,109 @@
+# 64-bit boards where bit n is square n of rules.py (a8 is bit 0, h1 is bit 63)
+
+FULL = (1 << 64) - 1
+
+def bit(sq):
+    return 1 << sq
+
+def squares(bb):
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+def lowestSquare(bb):
+    return (bb & -bb).bit_length() - 1
+
+def popCount(bb):
+    return bin(bb).count('1')
+
+def _walk(sq, step, occupied=0, edges=True):
+    bb = 0
+    column, row = sq % 8, sq // 8
+    while True:
+        column, row = column + step[0], row + step[1]
+        if not (0 <= column <= 7 and 0 <= row <= 7):
+            break
+        if not edges and not (0 <= column + step[0] <= 7 and 0 <= row + step[1] <= 7):
+            break
+        s = row * 8 + column
+        bb |= 1 << s
+        if occupied & (1 << s):
+            break
+    return bb
+
+def _jumps(sq, steps):
+    bb = 0
+    for step in steps:
+        column, row = sq % 8 + step[0], sq // 8 + step[1]
+        if 0 <= column <= 7 and 0 <= row <= 7:
+            bb |= 1 << (row * 8 + column)
+    return bb
+
+ORTHOGONAL = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+DIAGONAL = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+
+KNIGHT_ATTACKS = [_jumps(sq, KNIGHT_STEPS) for sq in range(64)]
+KING_ATTACKS = [_jumps(sq, ORTHOGONAL + DIAGONAL) for sq in range(64)]
+# White pawns move up the board (towards row 0), black pawns move down
+PAWN_ATTACKS = [[_jumps(sq, [(-1, -1), (1, -1)]) for sq in range(64)], [_jumps(sq, [(-1, 1), (1, 1)]) for sq in range(64)]]
+
+ROWS = [0xFF << (8 * row) for row in range(8)]
+
+#region Sliding pieces
+
+# Relevant blocker squares (the far edge of each ray can never block anything)
+ROOK_MASKS = [sum(_walk(sq, s, edges=False) for s in ORTHOGONAL) for sq in range(64)]
+BISHOP_MASKS = [sum(_walk(sq, s, edges=False) for s in DIAGONAL) for sq in range(64)]
+
+ROOK_RAYS = [sum(_walk(sq, s) for s in ORTHOGONAL) for sq in range(64)]
+BISHOP_RAYS = [sum(_walk(sq, s) for s in DIAGONAL) for sq in range(64)]
+
+# Python has no cheap fixed width multiply, so instead of magic multipliers the masked
+# occupancy indexes a per-square dict directly. Entries are filled the first time a
+# blocker pattern is seen, which keeps startup free of table generation.
+_rookTables = [{} for _ in range(64)]
+_bishopTables = [{} for _ in range(64)]
+
+def rookAttacks(sq, occupied):
+    key = occupied & ROOK_MASKS[sq]
+    table = _rookTables[sq]
+    attacks = table.get(key)
+    if attacks is None:
+        attacks = table[key] = sum(_walk(sq, s, key) for s in ORTHOGONAL)
+    return attacks
+
+def bishopAttacks(sq, occupied):
+    key = occupied & BISHOP_MASKS[sq]
+    table = _bishopTables[sq]
+    attacks = table.get(key)
+    if attacks is None:
+        attacks = table[key] = sum(_walk(sq, s, key) for s in DIAGONAL)
+    return attacks
+
+def queenAttacks(sq, occupied):
+    return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+
+#endregion
+
+#region Lines
+
+def _lines():
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for step in ORTHOGONAL + DIAGONAL:
+            ray = _walk(sq, step)
+            full = ray | _walk(sq, (-step[0], -step[1])) | (1 << sq)
+            path = 0
+            for target in squares(ray) if step[0] + step[1] * 8 > 0 else reversed(list(squares(ray))):
+                between[sq][target] = path
+                line[sq][target] = full
+                path |= 1 << target
+    return between, line
+
+# Squares strictly between two aligned squares, and the whole board line through them
+BETWEEN, LINE = _lines()
+
+#endregion
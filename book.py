@@ -0,0 +1,146 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import rules
+
+# Opening book in the layout of Polyglot books: 16 byte big-endian records of
+# (position key, move, weight, learn) sorted by key. Keys are rules.Position.key and moves
+# are rules move ints rather than Polyglot's own, so the files aren't interchangeable with
+# other programs' books.
+RECORD = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+
+MAX_WEIGHT = 0xFFFF
+
+class Book:
+    def __init__(self, path):
+        # The file is mapped rather than read, so opening it costs nothing however big it is and
+        # only the records a lookup touches are ever loaded
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._count = size // RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._data:
+            self._data.close()
+        self._file.close()
+
+    def _firstIndex(self, key):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self._data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries(self, position):
+        # (move, weight) for each book move of the position. Moves that aren't legal, because
+        # another position has the same key, are left out.
+        key = position.key
+        legalMoves = None
+        entries = []
+        for index in range(self._firstIndex(key), self._count):
+            recordKey, move, weight, _ = RECORD.unpack_from(self._data, index * RECORD.size)
+            if recordKey != key:
+                break
+            if legalMoves == None:
+                legalMoves = position.legalMoves()
+            if move in legalMoves:
+                entries.append((move, weight))
+        return entries
+
+    def choose(self, position, rng=random):
+        # A book move picked at random in proportion to the weights, or None when out of book
+        entries = [(move, weight) for move, weight in self.entries(position) if weight > 0]
+        if not entries:
+            return None
+        return rng.choices([move for move, _ in entries], [weight for _, weight in entries])[0]
+
+#region Building
+
+def parseLine(text):
+    # Moves of an opening line as rules move ints, from space separated move names
+    # ("e2e4 e7e5 g1f3", promotions like "e7e8q")
+    position = rules.Position.initial()
+    moves = []
+    for name in text.split():
+        fromSq, toSq = rules.squareFromName(name[0:2]), rules.squareFromName(name[2:4])
+        promotion = rules.FEN_PIECES.index(name[4]) if len(name) > 4 else rules.QUEEN
+        move = position.findMove(fromSq, toSq, promotion)
+        if move == None:
+            raise ValueError(f"Illegal move {name} after {' '.join(rules.moveName(m) for m in moves) or 'the start'}")
+        position.push(move)
+        moves.append(move)
+    return moves
+
+def build(lines, path, plies=None):
+    # Writes a book of every move played in lines (lists of moves from the starting position),
+    # weighted by how often it was played from the same position. Returns the number of records.
+    counts = {}
+    for moves in lines:
+        position = rules.Position.initial()
+        for move in moves[:plies]:
+            key = (position.key, move)
+            counts[key] = counts.get(key, 0) + 1
+            position.push(move)
+
+    with open(path, 'wb') as f:
+        for (key, move), count in sorted(counts.items()):
+            f.write(RECORD.pack(key, move, min(count, MAX_WEIGHT), 0))
+    return len(counts)
+
+def readLines(path):
+    # One opening per line, blank lines and lines starting with # are skipped
+    with open(path, 'r') as f:
+        for number, text in enumerate(f, 1):
+            text = text.strip()
+            if text and not text.startswith('#'):
+                try:
+                    yield parseLine(text)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{number}: {e}")
+
+#endregion
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Build or look into an opening book")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    buildParser = commands.add_parser('build', help="build a book from a file of opening lines")
+    buildParser.add_argument('lines', help="text file with one line of moves like e2e4 e7e5 per opening")
+    buildParser.add_argument('book', help="book file to write")
+    buildParser.add_argument('--plies', type=int, help="only use this many moves of each line")
+
+    probeParser = commands.add_parser('probe', help="list the book moves of a position")
+    probeParser.add_argument('book', help="book file to read")
+    probeParser.add_argument('--fen', default=rules.STARTING_FEN, help="position to look up (default: the starting position)")
+    options = parser.parse_args(args)
+
+    if options.command == 'build':
+        records = build(readLines(options.lines), options.book, options.plies)
+        print(f"Wrote {records} records to {options.book}")
+        return 0
+
+    book = Book(options.book)
+    entries = sorted(book.entries(rules.Position.fromFen(options.fen)), key=lambda entry: -entry[1])
+    total = sum(weight for _, weight in entries)
+    for move, weight in entries:
+        print(f"{rules.moveName(move)}: {weight} ({weight / total:.0%})")
+    if not entries:
+        print("Not in book")
+    book.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
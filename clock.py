@@ -2,13 +2,23 @@ from pygame_tool import *
 import math
 
 class Clock:
+    # Rendered digits and colons by (character, color), shared by every clock. Times are put
+    # together from these instead of rendering whole strings.
+    _glyphs = {}
+
     def __init__(self, game, win_size, historyButtons):
-        self._lastTicks = pygame.time.get_ticks()
+        # Time is kept in milliseconds of game.getTicks(), which never goes backwards. Each
+        # side's time left is stored as of the start of its turn and the running side's is worked
+        # out from the ticks since then, so no time is lost between frames or turns.
+        seconds = game.settings['clockTime'] if game.settings['clockTime'] > 0 else 1800
+        self._remaining = [seconds * 1000 for _ in range(2)]
+        # Fischer increment: added after every move. Bronstein delay: up to this much of the
+        # time a move took is given back after it.
+        self.increment = game.settings['clockIncrement'] * 1000
+        self.delay = game.settings['clockDelay'] * 1000
+        self._running = None
+        self._turnStart = 0
 
-        if game.settings['clockTime'] > 0:
-            self.time = [game.settings['clockTime'] for _ in range(2)]
-        else:
-            self.time = [1800 for _ in range(2)]
         self.boxes = [None, None]
         self.text = [GameObject(pygame.Surface(size=(0, 0))) for _ in range(2)]
 
@@ -19,8 +29,11 @@ class Clock:
         self.game = game
         self.timeOut = False
         self.enabled = True
+        self._start(int(game.currentSide.color))
 
-        self._timeText = Text('', "Assets\\Fonts\\Montserrat\\Montserrat-Regular.ttf", 16, (0, 0, 0), True)
+        self._timeText = Text('', "Assets/Fonts/Montserrat/Montserrat-Regular.ttf", 16, (0, 0, 0), True)
+        # (time string, color) each side's text was last rendered with
+        self._shown = [None, None]
         self._update()
 
         game.addGameObject(self.text[0])
@@ -29,6 +42,7 @@ class Clock:
         game.event(pygame.MOUSEBUTTONDOWN)(self._onMouseDown)
         game.event(pygame.MOUSEMOTION)(self._onMouseMotion)
         game.update(self._update)
+        game.deadline(self.timeUntilDisplayChange)
 
         self.historyButtons = historyButtons
         self._gameOverTextObj = None
@@ -83,64 +97,132 @@ class Clock:
                     if t in self.game._gameObjects:
                         self.game.removeGameObject(t)
 
+    @property
+    def time(self):
+        # Seconds left for each side
+        return [self.remaining(side) / 1000 for side in range(2)]
+
+    @time.setter
+    def time(self, seconds):
+        self._remaining = [round(s * 1000) for s in seconds]
+        self._turnStart = self.game.getTicks()
+
+    def remaining(self, side):
+        # Milliseconds left for side right now
+        if side == self._running:
+            return self._remaining[side] - (self.game.getTicks() - self._turnStart)
+        return self._remaining[side]
+
+    def _start(self, side):
+        self._running = side
+        self._turnStart = self.game.getTicks()
+
+    def _stop(self):
+        if self._running != None:
+            self._remaining[self._running] = self.remaining(self._running)
+            self._running = None
+
+    def moveMade(self):
+        # Called when the side whose clock is running has made its move, before the turn passes
+        side = self._running
+        if (side == None) or self.timeOut:
+            return
+        used = self.game.getTicks() - self._turnStart
+        self._remaining[side] -= max(0, used - self.delay)
+        self._remaining[side] += self.increment
+        self._start(1 - side)
+
+    def timeUntilDisplayChange(self):
+        # Seconds until the running side's displayed time goes down a second, None while stopped,
+        # turned off or after the game. Times are shown rounded up, so that is also when it runs out.
+        if self.timeOut or (self._running == None) or not self.enabled or self.game.gameOver:
+            return None
+        remaining = self.remaining(self._running)
+        return ((remaining - 1) % 1000 + 1) / 1000 if remaining > 0 else 0
+
     def _update(self):
-        if self.timeOut or self.game.gameOver:
+        if self.timeOut:
             return
 
-        currentSide = int(self.game.currentSide.color)
-        
-        if pygame.time.get_ticks() - self._lastTicks >= 1000:
-            self._updateTime(currentSide)
+        # Undo and redo change sides without a move, and nobody's time runs once the game is over
+        side = None if self.game.gameOver else int(self.game.currentSide.color)
+        if side != self._running:
+            self._stop()
+            if side != None:
+                self._start(side)
+
+        if (self._running != None) and (self.remaining(self._running) <= 0):
+            self._outOfTime(self._running)
+            if self.timeOut and not self.enabled:
+                return
 
+        colors = [(0, 0, 0), (255, 255, 255)] if self.enabled else [(0, 0, 0), (0, 0, 0)]
         for side in range(2):
-            self._timeText.text = self._formatTime(self.time[side])
-            colors = [(0, 0, 0), (255, 255, 255)] if self.enabled else [(0, 0, 0), (0, 0, 0)]
-            self._timeText.color = colors[side]
-            self.text[side]._surface = self._timeText.render()
+            shown = (self._formatTime(self.remaining(side)), colors[side])
+            if shown == self._shown[side]:
+                continue
+            self._shown[side] = shown
+            self.text[side]._surface = self._renderTime(*shown)
 
             self._positionText(self.text[side], self.boxes[side])
 
-    def _updateTime(self, side):
-        self.time[side] -= 1
-        self._lastTicks = pygame.time.get_ticks()
-
-        if (self.time[side] <= 0) and not self.timeOut:
-            self.timeOut = True
-            if self.enabled:
-                
-                enemyPieces = []
-                for p in self.game.squares.values():
-                    if int(p.color) != side:
-                        enemyPieces.append(type(p).__name__)
-
-                # insufficient mating material
-                immList = [['King'], ['King', 'Knight'], ['King', 'Bishop']]
-                imm = False
-                for i in immList:
-                    if all([p in i for p in enemyPieces]):
-                        imm = True
-                        break
-
-                title = Text("", "Assets/Fonts/Montserrat/Montserrat-Bold.ttf", 40, (0, 0, 0), True)
-                subtitle = Text(
-                    "Disable the clock if you wish to continue",
-                    "Assets/Fonts/Montserrat/Montserrat-Medium.ttf", 16, (0, 0, 0), True
-                )
-                if imm:
-                    title.text = 'Draw'
-                else:
-                    title.text = ['Black', 'White'][side] + ' wins'
-                self._gameOverTextObj = self.game._botText(title, self._gameOverTextObj, False, True, offset=(0, -10))
-                self._subtitleTextObj = self.game._botText(subtitle, self._subtitleTextObj, False, True, offset=(0, 20), ignoreCapPieces=True)
-                self.game._gameOver = True
-                
-                for b in self.historyButtons:
-                    if b.inGame:
-                        b.remove(self.game)
-
+    def _glyph(self, char, color):
+        key = (char, color)
+        glyph = Clock._glyphs.get(key)
+        if glyph == None:
+            self._timeText.text = char
+            self._timeText.color = color
+            glyph = Clock._glyphs[key] = self._timeText.render()
+        return glyph
+
+    def _renderTime(self, text, color):
+        glyphs = [self._glyph(char, color) for char in text]
+        surface = pygame.Surface((sum(g.get_width() for g in glyphs), max(g.get_height() for g in glyphs)), pygame.SRCALPHA)
+        x = 0
+        for glyph in glyphs:
+            surface.blit(glyph, (x, 0))
+            x += glyph.get_width()
+        return surface
+
+    def _outOfTime(self, side):
+        self._remaining[side] = 0
+        self._running = None
+        self.timeOut = True
+        if self.enabled:
+
+            enemyPieces = []
+            for p in self.game.squares.values():
+                if int(p.color) != side:
+                    enemyPieces.append(type(p).__name__)
+
+            # insufficient mating material
+            immList = [['King'], ['King', 'Knight'], ['King', 'Bishop']]
+            imm = False
+            for i in immList:
+                if all([p in i for p in enemyPieces]):
+                    imm = True
+                    break
+
+            title = Text("", "Assets/Fonts/Montserrat/Montserrat-Bold.ttf", 40, (0, 0, 0), True)
+            subtitle = Text(
+                "Disable the clock if you wish to continue",
+                "Assets/Fonts/Montserrat/Montserrat-Medium.ttf", 16, (0, 0, 0), True
+            )
+            if imm:
+                title.text = 'Draw'
             else:
+                title.text = ['Black', 'White'][side] + ' wins'
+            self._gameOverTextObj = self.game._botText(title, self._gameOverTextObj, False, True, offset=(0, -10))
+            self._subtitleTextObj = self.game._botText(subtitle, self._subtitleTextObj, False, True, offset=(0, 20), ignoreCapPieces=True)
+            self.game._gameOver = True
+
+            for b in self.historyButtons:
+                if b.inGame:
+                    b.remove(self.game)
+
+        else:
 
-                self.remove()
+            self.remove()
 
     def remove(self):
         for t in self.text: 
@@ -150,9 +232,12 @@ class Clock:
         self.game.removeEvent(pygame.MOUSEBUTTONDOWN, self._onMouseDown)
         self.game.removeEvent(pygame.MOUSEMOTION, self._onMouseMotion)
         self.game._updateCallbacks.remove(self._update)
+        self.game._deadlineCallbacks.remove(self.timeUntilDisplayChange)
 
-    def _formatTime(self, seconds):
-        return f"{math.floor(seconds/60)}:{seconds%60}"
+    def _formatTime(self, milliseconds):
+        # Whole seconds rounded up, so 0:00 only shows once the time has run out
+        seconds = max(0, math.ceil(milliseconds / 1000))
+        return f"{seconds // 60}:{seconds % 60:02d}"
 
     def _positionText(self, text, box):
         text.position = (box.size[0]/2 - text.size[0]/2 + box.position[0], box.size[1]/2 - text.surface.get_height()/2 + box.position[1])
\ No newline at end of file
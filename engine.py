@@ -0,0 +1,382 @@
+import time
+
+from rules import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, moveFrom, moveTo, movePromotion
+from bitboards import squares
+from tablebase import pliesToMate
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+PIECE_VALUES = [100, 320, 330, 500, 900, 0]
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_DEPTH = 64
+
+# Scores above this are mates, the distance to mate is MATE_SCORE minus the score. Mates found
+# in tablebases can be much further away than the search ever looks.
+MATE_BOUND = MATE_SCORE - 1000
+
+#region Evaluation
+
+# Piece-square tables for white, laid out like the board (a8 first). Black uses the same
+# tables mirrored top to bottom.
+PAWN_TABLE = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    10,  10,  20,  30,  30,  20,  10,  10,
+     5,   5,  10,  25,  25,  10,   5,   5,
+     0,   0,   0,  20,  20,   0,   0,   0,
+     5,  -5, -10,   0,   0, -10,  -5,   5,
+     5,  10,  10, -20, -20,  10,  10,   5,
+     0,   0,   0,   0,   0,   0,   0,   0,
+]
+KNIGHT_TABLE = [
+   -50, -40, -30, -30, -30, -30, -40, -50,
+   -40, -20,   0,   0,   0,   0, -20, -40,
+   -30,   0,  10,  15,  15,  10,   0, -30,
+   -30,   5,  15,  20,  20,  15,   5, -30,
+   -30,   0,  15,  20,  20,  15,   0, -30,
+   -30,   5,  10,  15,  15,  10,   5, -30,
+   -40, -20,   0,   5,   5,   0, -20, -40,
+   -50, -40, -30, -30, -30, -30, -40, -50,
+]
+BISHOP_TABLE = [
+   -20, -10, -10, -10, -10, -10, -10, -20,
+   -10,   0,   0,   0,   0,   0,   0, -10,
+   -10,   0,   5,  10,  10,   5,   0, -10,
+   -10,   5,   5,  10,  10,   5,   5, -10,
+   -10,   0,  10,  10,  10,  10,   0, -10,
+   -10,  10,  10,  10,  10,  10,  10, -10,
+   -10,   5,   0,   0,   0,   0,   5, -10,
+   -20, -10, -10, -10, -10, -10, -10, -20,
+]
+ROOK_TABLE = [
+     0,   0,   0,   0,   0,   0,   0,   0,
+     5,  10,  10,  10,  10,  10,  10,   5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+     0,   0,   0,   5,   5,   0,   0,   0,
+]
+QUEEN_TABLE = [
+   -20, -10, -10,  -5,  -5, -10, -10, -20,
+   -10,   0,   0,   0,   0,   0,   0, -10,
+   -10,   0,   5,   5,   5,   5,   0, -10,
+    -5,   0,   5,   5,   5,   5,   0,  -5,
+     0,   0,   5,   5,   5,   5,   0,  -5,
+   -10,   5,   5,   5,   5,   5,   0, -10,
+   -10,   0,   5,   0,   0,   0,   0, -10,
+   -20, -10, -10,  -5,  -5, -10, -10, -20,
+]
+KING_TABLE = [
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -30, -40, -40, -50, -50, -40, -40, -30,
+   -20, -30, -30, -40, -40, -30, -30, -20,
+   -10, -20, -20, -20, -20, -20, -20, -10,
+    20,  20,   0,   0,   0,   0,  20,  20,
+    20,  30,  10,   0,   0,  10,  30,  20,
+]
+KING_ENDGAME_TABLE = [
+   -50, -40, -30, -20, -20, -30, -40, -50,
+   -30, -20, -10,   0,   0, -10, -20, -30,
+   -30, -10,  20,  30,  30,  20, -10, -30,
+   -30, -10,  30,  40,  40,  30, -10, -30,
+   -30, -10,  30,  40,  40,  30, -10, -30,
+   -30, -10,  20,  30,  30,  20, -10, -30,
+   -30, -30,   0,   0,   0,   0, -30, -30,
+   -50, -30, -30, -30, -30, -30, -30, -50,
+]
+
+# Kings head for the center once both sides are down to this much material besides pawns
+ENDGAME_MATERIAL = 1300
+
+def _squareValues(tables):
+    return [
+        [[PIECE_VALUES[pieceType] + table[sq] for sq in range(64)] for pieceType, table in enumerate(tables)],
+        [[PIECE_VALUES[pieceType] + table[sq ^ 56] for sq in range(64)] for pieceType, table in enumerate(tables)],
+    ]
+
+# Material plus position for [color][piece type][square]
+SQUARE_VALUES = _squareValues([PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE])
+ENDGAME_SQUARE_VALUES = _squareValues([PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_ENDGAME_TABLE])
+
+def evaluate(position):
+    # Score in centipawns for the side to move
+    material = 0
+    for color in (WHITE, BLACK):
+        for pieceType in (KNIGHT, BISHOP, ROOK, QUEEN):
+            for _ in squares(position.bitboards[color][pieceType]):
+                material += PIECE_VALUES[pieceType]
+    values = ENDGAME_SQUARE_VALUES if material <= ENDGAME_MATERIAL * 2 else SQUARE_VALUES
+
+    score = 0
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        for pieceType, bb in enumerate(position.bitboards[color]):
+            table = values[color][pieceType]
+            for sq in squares(bb):
+                score += sign * table[sq]
+    return score if position.sideToMove == WHITE else -score
+
+#endregion
+
+#region Time management
+
+def moveTime(remaining, maximum=None):
+    # Seconds to spend on the next move with remaining seconds on the clock. Plans for 30 more
+    # moves and keeps a reserve back, so the clock can't run out even when a search overshoots.
+    if remaining == None:
+        return maximum
+    seconds = max(0.05, min(remaining / 30, remaining / 2 - 1))
+    if maximum != None:
+        seconds = min(seconds, maximum)
+    return seconds
+
+#endregion
+
+# Mate scores count plies from the root, the table keeps them counted from the position itself
+def _scoreToTable(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def _scoreFromTable(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+def _tablebaseScore(value, ply):
+    if value > 0:
+        return MATE_SCORE - ply - pliesToMate(value)
+    if value < 0:
+        return -(MATE_SCORE - ply - pliesToMate(value))
+    return 0
+
+class _Timeout(Exception):
+    pass
+
+class Engine:
+    # Killer moves kept per ply
+    KILLERS = 2
+    # How many nodes pass between looks at the clock
+    TIME_CHECK_INTERVAL = 1024
+
+    def __init__(self, table=None, helper=0, tablebases=None):
+        self.table = table if table != None else TranspositionTable()
+        # Helpers search next to a main search sharing its table (see worker.py)
+        self.helper = helper
+        # Positions with few enough pieces are looked up rather than searched (see tablebase.py)
+        self.tablebases = tablebases
+        self.nodes = 0
+        self.depth = 0
+        self.score = 0
+        self.bestMove = None
+
+        self._killers = [[None] * self.KILLERS for _ in range(MAX_DEPTH + 1)]
+        self._history = [[[0] * 64 for _ in range(64)] for _ in range(2)]
+        self._deadline = None
+        self._stop = None
+
+    def search(self, position, seconds=None, maxDepth=MAX_DEPTH, stop=None, progress=None):
+        # Best move for the side to move, found by searching one ply deeper at a time until
+        # the time or maxDepth is used up, or until stop (anything with is_set(), like a
+        # threading or multiprocessing Event) is set. progress is called with
+        # (depth, score, best move, nodes) after each depth. Returns None if there are no legal moves.
+        self.nodes = 0
+        self.depth = 0
+        self.score = 0
+        self.bestMove = None
+        self._deadline = None if seconds == None else time.perf_counter() + seconds
+        self._stop = stop
+        for killers in self._killers:
+            killers[:] = [None] * self.KILLERS
+        for table in self._history:
+            for row in table:
+                for i in range(64):
+                    row[i] >>= 2
+        self.table.newSearch()
+
+        # The search unwinds with an exception when time runs out, so it works on a copy
+        position = position.copy()
+        moves = position.legalMoves()
+        if not moves:
+            return None
+        self.bestMove = moves[0]
+
+        value = self._probeTablebases(position)
+        move = self.tablebases.bestMove(position) if value != None else None
+        # Without a table for an ending one of the moves leads to, the move is searched for
+        if move != None:
+            self.bestMove = move
+            self.score = _tablebaseScore(value, 0)
+            if progress != None:
+                progress(self.depth, self.score, self.bestMove, self.nodes)
+            return self.bestMove
+
+        entry = self.table.probe(position.key)
+        if entry != None and entry[0] in moves:
+            self.bestMove = entry[0]
+
+        for depth in range(1, maxDepth + 1):
+            # Helpers skip every other depth, so they are mostly a ply ahead of the main search and
+            # different helpers fill the table with different results
+            if self.helper and depth > 1 and (depth + self.helper) % 2 == 0:
+                continue
+            try:
+                score = self._searchRoot(position, moves, depth)
+            except _Timeout:
+                break
+            self.depth = depth
+            self.score = score
+            if progress != None:
+                progress(depth, score, self.bestMove, self.nodes)
+            if abs(score) >= MATE_BOUND:
+                break
+        return self.bestMove
+
+    def _searchRoot(self, position, moves, depth):
+        alpha, beta = -INFINITY, INFINITY
+        # The previous iteration's best move goes first, so a search cut short by the clock
+        # still has it as its fallback
+        moves.sort(key=lambda move: self._moveOrder(position, move, 0), reverse=True)
+        moves.remove(self.bestMove)
+        moves.insert(0, self.bestMove)
+
+        for move in moves:
+            position.push(move)
+            score = -self._alphaBeta(position, depth - 1, -beta, -alpha, 1)
+            position.pop()
+            if score > alpha:
+                alpha = score
+                self.bestMove = move
+        return alpha
+
+    def _alphaBeta(self, position, depth, alpha, beta, ply):
+        self._countNode()
+
+        if ply > 0 and (position.halfmoveClock >= 100 or position.repetitions() >= 2 or position.insufficientMaterial()):
+            return 0
+
+        value = self._probeTablebases(position)
+        if value != None:
+            return _tablebaseScore(value, ply)
+
+        inCheck = position.inCheck()
+        if inCheck and ply < MAX_DEPTH:
+            depth += 1
+        if depth <= 0 or ply >= MAX_DEPTH:
+            return self._quiescence(position, alpha, beta, ply)
+
+        key = position.key
+        tableMove = None
+        entry = self.table.probe(key)
+        if entry != None:
+            tableMove, score, tableDepth, bound = entry
+            if tableDepth >= depth:
+                score = _scoreFromTable(score, ply)
+                if (bound == EXACT) or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+
+        moves = position.legalMoves()
+        if not moves:
+            return -(MATE_SCORE - ply) if inCheck else 0
+        moves.sort(key=lambda move: self._moveOrder(position, move, ply, tableMove), reverse=True)
+
+        originalAlpha = alpha
+        bestScore, bestMove = -INFINITY, None
+        for move in moves:
+            quiet = not position.isCapture(move) and not movePromotion(move)
+            position.push(move)
+            score = -self._alphaBeta(position, depth - 1, -beta, -alpha, ply + 1)
+            position.pop()
+
+            if score > bestScore:
+                bestScore, bestMove = score, move
+            if score >= beta:
+                if quiet:
+                    self._storeKiller(move, ply)
+                    self._history[position.sideToMove][moveFrom(move)][moveTo(move)] += depth * depth
+                break
+            if score > alpha:
+                alpha = score
+
+        bound = LOWER if bestScore >= beta else (UPPER if bestScore <= originalAlpha else EXACT)
+        self.table.store(key, bestMove, _scoreToTable(bestScore, ply), depth, bound)
+        return bestScore
+
+    def _probeTablebases(self, position):
+        if self.tablebases == None:
+            return None
+        return self.tablebases.probe(position)
+
+    def _quiescence(self, position, alpha, beta, ply):
+        # Only captures and promotions are searched until the position is quiet, so the static
+        # evaluation is never taken in the middle of an exchange. In check every evasion counts.
+        self._countNode()
+        if ply >= MAX_DEPTH:
+            return evaluate(position)
+
+        inCheck = position.inCheck()
+        if not inCheck:
+            standPat = evaluate(position)
+            if standPat >= beta:
+                return standPat
+            alpha = max(alpha, standPat)
+
+        moves = position.legalMoves()
+        if not moves:
+            return -(MATE_SCORE - ply) if inCheck else 0
+        if not inCheck:
+            moves = [move for move in moves if position.isCapture(move) or movePromotion(move)]
+        moves.sort(key=lambda move: self._moveOrder(position, move, ply), reverse=True)
+
+        for move in moves:
+            position.push(move)
+            score = -self._quiescence(position, -beta, -alpha, ply + 1)
+            position.pop()
+
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    #region Move ordering
+
+    def _moveOrder(self, position, move, ply, tableMove=None):
+        # The best move found for the position before, then captures by most valuable victim and
+        # least valuable attacker, then killers, then quiet moves by how often they caused a cutoff
+        if move == tableMove:
+            return 3000000
+        fromSq, toSq = moveFrom(move), moveTo(move)
+        promotion = movePromotion(move)
+        victim = position.board[toSq]
+        if victim is not None or promotion or position.isEnPassant(move):
+            victimValue = PIECE_VALUES[victim[1]] if victim is not None else PIECE_VALUES[PAWN]
+            if promotion:
+                victimValue += PIECE_VALUES[promotion]
+            return 2000000 + victimValue * 8 - position.board[fromSq][1]
+        killers = self._killers[ply]
+        if move in killers:
+            return 1900000 - killers.index(move)
+        return self._history[position.sideToMove][fromSq][toSq]
+
+    def _storeKiller(self, move, ply):
+        killers = self._killers[ply]
+        if killers[0] != move:
+            killers.pop()
+            killers.insert(0, move)
+
+    #endregion
+
+    def _countNode(self):
+        self.nodes += 1
+        if self.nodes % self.TIME_CHECK_INTERVAL == 0:
+            if (self._deadline != None and time.perf_counter() >= self._deadline) or (self._stop != None and self._stop.is_set()):
+                raise _Timeout()
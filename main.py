@@ -1,11 +1,16 @@
 import os
-from abc import abstractmethod
 from enum import IntEnum
 import math
 import json
 
 from pygame_tool import *
 from clock import Clock
+import rules
+from bitboards import popCount
+import engine
+import worker
+import book
+import movelog
 import pygame
 
 WIN_SIZE = (800, 800)
@@ -17,23 +22,27 @@ CAPTURED_PIECE_PADDING = 5
 CAPTURED_PIECE_ROW_SPACING = 6
 CAPTURED_PIECE_ROWS_OFFSET = -5
 
-#region Util
+# Everything else (captured pieces, text, buttons, the selection outline) goes on layer 0
+BOARD_LAYER = -4
+RED_CLICK_LAYER = -3
+HIGHLIGHT_LAYER = -2
+PIECE_LAYER = -1
+
+# Where the game run from the command line is logged, so it can be resumed after a crash
+GAME_LOG = os.path.join('Saves', 'Game.log')
 
-def inCheck(pos, side):
-  _otherSide = game.sides[abs(int(side.color)-1)]
+#region Util
 
-  for p in _otherSide.pieces:
-    if p.canMoveTo(pos, kingCheck=False, castling=False):
-      return True
-  return False
+def boardPosToSquare(position):
+  if game.sides[0].moveDirection != 1:
+    position = (7-position[0], 7-position[1])
+  return rules.square(*position)
 
-def emptyPath(piece, relPos):
-  length = abs(relPos[0 if relPos[0] != 0 else 1])
-  for i in range(1, int(length)):
-    square = (i/length * relPos[0] + piece.boardPosition[0], i/length * relPos[1] + piece.boardPosition[1])
-    if game.squares.get(square):
-      return False
-  return True
+def squareToBoardPos(square):
+  position = rules.squareCoords(square)
+  if game.sides[0].moveDirection != 1:
+    position = (7-position[0], 7-position[1])
+  return position
 
 def pixelToBoardPos(position):
     column = math.floor((position[0]-BOARD_OFFSET[0])/BOARD_SIZE[0] * 8)
@@ -54,12 +63,21 @@ def capturedPieceRows():
 def capturedPieceSquareSize():
   return int(WIN_SIZE[0]/16) - CAPTURED_PIECE_PADDING
 
+def pieceSprite(name, color, size):
+  colorValue = {Color.WHITE: 255, Color.BLACK: 0}[color]
+  colorName = {Color.WHITE: 'White', Color.BLACK: 'Black'}[color]
+  try:
+    return loadImage(os.path.join('Assets/Pieces', f'{name}_{colorName}.png'), size)
+  except:
+    return pygame.Color(colorValue, colorValue, colorValue)
+
+def capturedPieceObject(name, color, side):
+  size = capturedPieceSquareSize()
+  return GameObject(pieceSprite(name, color, (size, size)), size=(size, size), position=(len(side.capturedPieces)*size + CAPTURED_PIECE_PADDING, capturedPieceRows()[int(color)]))
+
 def squareSize():
     return (int(BOARD_SIZE[0]/8), int(BOARD_SIZE[1]/8))
 
-def isLine(relPos):
-  return (abs(relPos[0]) == abs(relPos[1])) or ((relPos[0] == 0) ^ (relPos[1] == 0))
-
 def otherSide():
   return game.sides[0] if game.currentSide == game.sides[1] else game.sides[1]
 
@@ -77,93 +95,114 @@ def centerBotText(botText, offset=(0, 0)):
 #region Classes
 
 class Side:
-  def __init__(self, color, game):
+  def __init__(self, color, game, position):
     self.color = color
     self.moveDirection = [1, -1][int(color)]
-    self.capturedPieces = {}
-    self._capturedPiecesPositions = {}
+    self.capturedPieces = []
     self.game = game
-    self.init()
-
-  def init(self, positions=None, piecesMoved=[], capturedPieces=None):
-    if positions == None:
-      positions = STARTING_POSITIONS
-
-    for piece, _positions in positions[self.color].items():
-      for position in _positions:
-        pos = position
-        if self.moveDirection != [1, -1][int(self.color)]:
-          pos = (7-pos[0], 7-pos[1])
-        self.game.addGameObject(piece(self, pos, self.game, moved=(position in piecesMoved)))
-
-    if capturedPieces != None:
-      for p, gObj in self.capturedPieces.copy().items():
-        if p not in capturedPieces.keys():
-          self.game.removeGameObject(gObj)
-          self.capturedPieces.pop(p)
-      for p, gObj in capturedPieces.items():
-        if p not in self.capturedPieces.keys():
-          self.game.addGameObject(gObj)
-          self.capturedPieces[p] = gObj
-          self._capturedPiecesPositions[p] = gObj
-
-  @property
-  def pieces(self):
-    _pieces = []
-    for sqr in game.squares.values():
-      if sqr != None:
-        if sqr.color == self.color:
-          _pieces.append(sqr)
-    return _pieces
-
-  @property
-  def kingPos(self):
-    for pos, piece in game.squares.items():
-      if piece.color == self.color:
-        if isinstance(piece, King):
-          return pos
-    return None
-
-class ChessVersion:
+    self.init(position)
+
+  def init(self, position):
+    # Creates this side's pieces for a rules.Position in one go
+    color = int(self.color)
+    for sq, piece in enumerate(position.board):
+      if (piece is None) or (piece[0] != color):
+        continue
+      pos = rules.squareCoords(sq)
+      if self.moveDirection != [1, -1][color]:
+        pos = (7-pos[0], 7-pos[1])
+      self.game.addGameObject(PIECE_CLASSES[piece[1]](self, pos, self.game))
+
+class HistoryStep:
+  # The changes one history step made to the board, in order, so undo and redo only touch the
+  # squares involved instead of rebuilding every piece
   def __init__(self, _game):
-    normalized = _game.squares.copy()
-    if _game.sides[0].moveDirection != 1:
-      normalizedCopy = normalized.copy()
-      normalized = {}
-      for pos, piece in normalizedCopy.items():
-        normalized[(7-pos[0], 7-pos[1])] = piece
-
-    self.positions = {Color.WHITE: {}, Color.BLACK: {}}
-    self.piecesMoved = []
-    for pos, piece in normalized.items():
-      if self.positions[piece.color].get(type(piece)) == None:
-        self.positions[piece.color][type(piece)] = [pos]
-      else:
-        self.positions[piece.color][type(piece)].append(pos)
-
-      if piece.moved:
-        self.piecesMoved.append(pos)
-
-    self.capturedPieces = {s.color:{k : v.position for k, v in s.capturedPieces.items()} for s in _game.sides}
-    self.currentSide = _game.sides.index(_game.currentSide)
-    self.gameOver = _game.gameOver
-
-    self.promotionPawn = _game.promotionPawn
-    if self.promotionPawn != None:
-      promoPos = self.promotionPawn.boardPosition
-      if _game.sides[0].moveDirection != 1:
-        promoPos = (7-promoPos[0], 7-promoPos[1])
-      self.promotionPawn = promoPos
-
-    self.enPassant = _game.enPassant
-    if self.enPassant != None:
-      if _game.sides[0].moveDirection != 1:
-        self.enPassant = (7-self.enPassant[0], 7-self.enPassant[1])
+    self.game = _game
+    self.changes = []
+    self.before = _game.state()
+    self.after = None
+
+  def record(self, *change):
+    self.changes.append(change)
+    self._apply(change)
+
+  def apply(self):
+    for change in self.changes:
+      self._apply(change)
+    self.game.setState(self.after)
+
+  def revert(self):
+    self.game.setState(self.before)
+    for change in reversed(self.changes):
+      self._revert(change)
+
+  def _apply(self, change):
+    _game = self.game
+    kind = change[0]
+
+    if kind == 'move':
+      _, piece, fromSquare, toSquare = change
+      piece.boardPosition = squareToBoardPos(toSquare)
+
+    elif kind == 'capture':
+      _, piece, square, capturedObj, side = change
+      _game.removeGameObject(piece)
+      if _game.squares.get(piece.boardPosition) == piece:
+        _game.squares.pop(piece.boardPosition)
+      side.capturedPieces.append(capturedObj)
+      if _game.capturedPiecesVisible:
+        _game.addGameObject(capturedObj)
+
+    elif kind == 'promote':
+      _, pawn, newPiece, square = change
+      _game.removeGameObject(pawn)
+      _game.addGameObject(newPiece)
+      newPiece.boardPosition = squareToBoardPos(square)
+
+    elif kind == 'push':
+      _game.position.push(change[1])
+
+  def _revert(self, change):
+    _game = self.game
+    kind = change[0]
+
+    if kind == 'move':
+      _, piece, fromSquare, toSquare = change
+      piece.boardPosition = squareToBoardPos(fromSquare)
+
+    elif kind == 'capture':
+      _, piece, square, capturedObj, side = change
+      side.capturedPieces.remove(capturedObj)
+      if capturedObj in _game._gameObjects:
+        _game.removeGameObject(capturedObj)
+      _game.addGameObject(piece)
+      piece.boardPosition = squareToBoardPos(square)
+
+    elif kind == 'promote':
+      _, pawn, newPiece, square = change
+      _game.removeGameObject(newPiece)
+      if _game.squares.get(newPiece.boardPosition) == newPiece:
+        _game.squares.pop(newPiece.boardPosition)
+      _game.addGameObject(pawn)
+      pawn.boardPosition = squareToBoardPos(square)
+
+    elif kind == 'push':
+      _game.position.pop()
 
 class Chess(Game):
-  def __init__(self):
-    super().__init__(WIN_SIZE, windowTitle="Chess")
+  def __init__(self, fen=None, gameLog=None, **options):
+    super().__init__(WIN_SIZE, **{'windowTitle': "Chess", 'eventDriven': True, **options})
+    # Position games start from, the startFen setting (or the usual start) when None. Without
+    # it the game in the gameLog file is resumed if it wasn't finished.
+    self.startFen = fen
+    # Where games are logged as they are played, None to not log them
+    self.gameLog = gameLog
     self._buttons = []
+    self.searchWorker = None
+    self.book = None
+    self.moveLog = None
+    self.update(self._syncMoveLog)
+    self.deadline(self._timeUntilMoveLogSync)
     self.init()
 
   def init(self):
@@ -171,31 +210,145 @@ class Chess(Game):
       self.settings = json.loads(f.read())
 
     self._gameObjects.clear()
+    self.cacheLayer(BOARD_LAYER)
+    self.cacheLayer(HIGHLIGHT_LAYER)
+    self.cacheLayer(PIECE_LAYER)
 
-    background = GameObject(pygame.image.load(os.path.join('Assets', 'Chess Board v3.png')), size=BOARD_SIZE, position=BOARD_OFFSET)
-    self.addGameObject(background)
-    self.addGameObject(redClick)
+    background = GameObject(loadImage(os.path.join('Assets', 'Chess Board v3.png'), BOARD_SIZE), size=BOARD_SIZE, position=BOARD_OFFSET)
+    self.addGameObject(background, BOARD_LAYER)
+    self.addGameObject(redClick, RED_CLICK_LAYER)
 
     self.squares = {}
     self.selectedPiece = None
+    self.moveHighlights = []
+    self._legalMoves = None
     self.flippingBoard = False
-    self.sides = [Side(c, self) for c in [Color.WHITE, Color.BLACK]]
-    self.currentSide = self.sides[0]
-    self.enPassant = None
+    logged = None
+    if (self.moveLog == None) and (self.startFen == None) and (self.gameLog != None):
+      logged = self._readMoveLog()
+    if logged != None:
+      startFen, self.position, times = logged
+    else:
+      startFen = self.startFen or self.settings['startFen'] or rules.STARTING_FEN
+      self.position = rules.Position.fromFen(startFen)
+    self.sides = [Side(c, self, self.position) for c in [Color.WHITE, Color.BLACK]]
+    self.currentSide = self.sides[self.position.sideToMove]
     self._gameOver = False
     self._promotionPawn = None
+    self.promotionMove = None
 
     self.updateColor()
 
     self.clock = Clock(self, WIN_SIZE, [undoButton, redoButton])
+    if logged != None:
+      self._showCapturedPieces(rules.Position.fromFen(startFen))
+      if times != None:
+        self.clock.time = times
 
     super().addButtons(self._buttons)
 
-    self.history = [self.version()] # list of HistoryObject
+    self.history = [] # list of HistoryStep, oldest first
+    self.historyStep = HistoryStep(self)
     self._historyIndex = 0
 
-  def version(self):
-    return ChessVersion(self)
+    if self.moveLog != None:
+      self.moveLog.close()
+      self.moveLog = None
+    if logged != None:
+      self.moveLog = movelog.MoveLog.resume(self.gameLog, len(self.position.moveStack), self._logClock)
+    elif self.gameLog != None:
+      self.moveLog = movelog.MoveLog(self.gameLog, startFen, self._logClock)
+
+    if self.searchWorker == None:
+      self.searchWorker = worker.SearchWorker(self, self.settings['engineHashSize'], self.settings['engineProcesses'], self.settings['engineTablebases'])
+    self.searchWorker.cancel()
+    if (self.book == None) and self.settings['engineBook']:
+      self.book = book.Book(self.settings['engineBook'])
+    if self.position.status() in (rules.Status.CHECKMATE, rules.Status.STALEMATE):
+      # Loaded positions can already be over, shown once the game is up
+      self.runAfterWait(endLoadedGame, 0)
+    elif engineToMove(self):
+      self.runAfterWait(playEngineMove, 0)
+
+  @property
+  def legalMoves(self):
+    # {board position of a piece: {board position it can move to: move}} for the side to move,
+    # worked out once per position. Promotions are stored as queen promotions, the piece is
+    # picked afterwards.
+    if self._legalMoves == None:
+      self._legalMoves = {}
+      for move in self.position.legalMoves():
+        if rules.movePromotion(move) in (0, rules.QUEEN):
+          targets = self._legalMoves.setdefault(squareToBoardPos(rules.moveFrom(move)), {})
+          targets[squareToBoardPos(rules.moveTo(move))] = move
+    return self._legalMoves
+
+  def invalidateLegalMoves(self):
+    # Called whenever the position or the board's orientation changes
+    self._legalMoves = None
+
+  def _readMoveLog(self):
+    # (start FEN, position, clocks) of the logged game, replayed through the rules alone, or None
+    # if there is none to carry on with
+    try:
+      logged = movelog.read(self.gameLog)
+      if (logged == None) or not logged[1]:
+        return None
+      startFen, moves, times = logged
+      position = movelog.replay(startFen, moves)
+    except (ValueError, OSError):
+      # A log that can't be read is dropped and a new game starts over it
+      return None
+    if position.status() in (rules.Status.CHECKMATE, rules.Status.STALEMATE):
+      return None
+    return startFen, position, times
+
+  def _showCapturedPieces(self, startPosition):
+    # Pieces missing since the start of a resumed game, as if they had been captured one by one
+    for color in range(2):
+      side = self.sides[1-color]
+      for pieceType in range(rules.KING):
+        missing = popCount(startPosition.bitboards[color][pieceType]) - popCount(self.position.bitboards[color][pieceType])
+        for _ in range(missing):
+          capPieceGameObject = capturedPieceObject(rules.PIECE_NAMES[pieceType], Color(color), side)
+          side.capturedPieces.append(capPieceGameObject)
+          self.addGameObject(capPieceGameObject)
+
+  def logMove(self):
+    # Called after each move. A move played after undoing some replaces them in the log too.
+    if self.moveLog == None:
+      return
+    moves = self.position.moveStack
+    if self.moveLog.plies >= len(moves):
+      self.moveLog.takeBack(self.moveLog.plies - len(moves) + 1)
+    self.moveLog.append(moves[-1], self.clock.time)
+
+  def _logClock(self):
+    return self.getTicks() / 1000
+
+  def _syncMoveLog(self):
+    if (self.moveLog != None) and (self.moveLog.timeUntilSync() == 0):
+      self.moveLog.sync()
+
+  def _timeUntilMoveLogSync(self):
+    return self.moveLog.timeUntilSync() if self.moveLog != None else None
+
+  @property
+  def fen(self):
+    return self.position.toFen()
+
+  def state(self):
+    return (self.sides.index(self.currentSide), self.gameOver, self.promotionPawn, self.promotionMove)
+
+  def setState(self, state):
+    self.currentSide = self.sides[state[0]]
+    self.gameOver = state[1]
+    self.promotionPawn = state[2]
+    self.promotionMove = state[3]
+
+  @property
+  def capturedPiecesVisible(self):
+    return not self.gameOver and self.promotionPawn == None
 
   @property
   def historyIndex(self):
@@ -203,42 +356,38 @@ class Chess(Game):
 
   @historyIndex.setter
   def historyIndex(self, index):
-    version = self.history[index]
-
-    for piece in self.squares.values():
-      self.removeGameObject(piece)
-    self.squares = {}
-    for s in self.sides:
-      s.init(positions=version.positions, piecesMoved=version.piecesMoved, capturedPieces={k : s._capturedPiecesPositions[v] for k, v in version.capturedPieces[s.color].items()})
-    self.currentSide = self.sides[version.currentSide]
-
-    self.gameOver = version.gameOver
+    self.searchWorker.cancel()
+    if self.selectedPiece != None:
+      changeSelection(None)
 
-    promoPawn = version.promotionPawn
-    if promoPawn != None:
-      if self.sides[0].moveDirection != 1:
-        promoPawn = (7-promoPawn[0], 7-promoPawn[1])
-      promoPawn = self.squares[promoPawn]
-    self.promotionPawn = promoPawn
+    while self._historyIndex < index:
+      self.history[len(self.history)-1-self._historyIndex].revert()
+      self._historyIndex += 1
+    while self._historyIndex > index:
+      self._historyIndex -= 1
+      self.history[len(self.history)-1-self._historyIndex].apply()
 
-    self.enPassant = version.enPassant
-    if self.enPassant != None:
-      if self.sides[0].moveDirection != 1:
-        self.enPassant = (7-self.enPassant[0], 7-self.enPassant[1])
+    self.historyStep = HistoryStep(self)
+    self.invalidateLegalMoves()
 
     self.updateColor()
-
-    self._historyIndex = index
     self.onHistoryChange()
 
+    # Undoing or redoing onto the engine's turn lets it move again
+    if engineToMove(self) and not self.gameOver:
+      self.runAfterWait(playEngineMove, 0)
+
   def updateHistory(self):
-    self.history = self.history[self.historyIndex:]
-    self.history.insert(0, self.version())
+    if self.historyIndex > 0:
+      del self.history[-self.historyIndex:]
+    self.historyStep.after = self.state()
+    self.history.append(self.historyStep)
+    self.historyStep = HistoryStep(self)
     self._historyIndex = 0
     self.onHistoryChange()
 
   def onHistoryChange(self):
-    if len(self.history) > self.historyIndex+1:
+    if len(self.history) > self.historyIndex:
       if not undoButton.inGame:
         undoButton.add(game)
     else:
@@ -290,7 +439,7 @@ class Chess(Game):
 
       if not ignoreCapPieces:
         for s in self.sides:
-          for p in s.capturedPieces.values():
+          for p in s.capturedPieces:
             self.removeGameObject(p)
 
     if not newBool and oldBool:
@@ -298,7 +447,7 @@ class Chess(Game):
 
       if not ignoreCapPieces:
         for s in self.sides:
-          for p in s.capturedPieces.values():
+          for p in s.capturedPieces:
             self.addGameObject(p)
 
     return textObj
@@ -308,47 +457,33 @@ class Color(IntEnum):
   BLACK = 1
 
 class Piece(GameObject):
-    def __init__(self, side, boardPosition, game, moved=False):
+    pieceType = None
+
+    def __init__(self, side, boardPosition, game):
         self.side = side
         self.game = game
         self.color = side.color
 
-        colorValue = {Color.WHITE: 255, Color.BLACK: 0}[self.color]
-        colorName = {Color.WHITE: 'White', Color.BLACK: 'Black'}[self.color]
-        try:
-          surface = pygame.image.load(os.path.join('Assets/Pieces', f'{self.name()}_{colorName}.png'))
-        except:
-          surface = pygame.Color(colorValue, colorValue, colorValue)
-        GameObject.__init__(self, surface, size=squareSize())
+        GameObject.__init__(self, self.sprite(squareSize()), size=squareSize())
+        self.layer = PIECE_LAYER
 
         self.boardPosition = boardPosition
-        self.moved = moved
 
     def name(self):
       return "Piece"
 
-    def canMoveTo(self, position, kingCheck=True, castling=True):
-        relPos = self.relativeBoardPos(position)
-        canMove = self._canMoveTo(position, relPos, castling=castling)
+    def sprite(self, size):
+        return pieceSprite(self.name(), self.color, size)
 
-        if canMove:
-          if isLine(relPos):
-            if emptyPath(self, relPos) == False:
-              canMove = False
+    def canMoveTo(self, position):
+        return position in self.game.legalMoves.get(self.boardPosition, ())
 
-        if canMove and kingCheck:
-          oldSquares = self.game.squares.copy()
-          self.game.squares.pop(self.boardPosition)
-          self.game.squares[position] = self
-          if inCheck(game.currentSide.kingPos, game.currentSide):
-            canMove = False
-          self.game.squares = oldSquares
+    def legalMove(self, position):
+        return self.game.legalMoves.get(self.boardPosition, {}).get(position)
 
-        return canMove
-
-    @abstractmethod
-    def _canMoveTo(self, position, relativePosition, **kwargs):
-        return True
+    @property
+    def square(self):
+        return boardPosToSquare(self.boardPosition)
 
     @property
     def boardPosition(self):
@@ -366,88 +501,56 @@ class Piece(GameObject):
     def relativeBoardPos(self, boardPos):
         return (boardPos[0]-self.boardPosition[0], boardPos[1]-self.boardPosition[1])
 
-    def onMoveTo(self, pos):
+    def onMoveTo(self, move):
+      self.game.historyStep.record('push', move)
       postMove()
 
     def move(self, pos):
+      move = self.legalMove(pos)
+
       currentPiece = self.game.squares.get(pos)
       if currentPiece:
         if currentPiece.color != self.game.currentSide.color:
           capture(currentPiece)
 
-      self.boardPosition = pos
+      self.game.historyStep.record('move', self, self.square, boardPosToSquare(pos))
       changeSelection(None)
 
-      self.moved = True
-
-      if pos != self.game.enPassant:
-        self.game.enPassant = None
-
-      self.onMoveTo(pos)
+      self.onMoveTo(move)
 
 class Rook(Piece):
-    def _canMoveTo(self, pos, relPos, **kwargs):
-        return (relPos[0] == 0) ^ (relPos[1] == 0)
+    pieceType = rules.ROOK
 
     def name(self):
       return "Rook"
 
 class Knight(Piece):
-    def _canMoveTo(self, pos, relPos, **kwargs):
-        horizontalL = ((abs(relPos[0]) == 2) and (abs(relPos[1]) == 1))
-        verticalL = ((abs(relPos[0]) == 1) and (abs(relPos[1]) == 2))
-        return horizontalL or verticalL
+    pieceType = rules.KNIGHT
 
     def name(self):
       return "Knight"
 
 class Bishop(Piece):
-    def _canMoveTo(self, pos, relPos, **kwargs):
-      return abs(relPos[0]) == abs(relPos[1])
+    pieceType = rules.BISHOP
 
     def name(self):
       return "Bishop"
 
 class Queen(Piece):
-    def _canMoveTo(self, pos, relPos, **kwargs):
-      return isLine(relPos)
+    pieceType = rules.QUEEN
 
     def name(self):
       return "Queen"
 
 class King(Piece):
-    def _canMoveTo(self, pos, relPos, **kwargs):
-      normalMovement = (abs(relPos[0]) <= 1) and (abs(relPos[1]) <= 1)
-
-      if kwargs['castling'] and (abs(relPos[0]) == 2) and (relPos[1] == 0):
-
-        xPos = [None, 7, 0][int(relPos[0]/abs(relPos[0]))]
-        self.castleRook = self.game.squares.get((xPos, self.boardPosition[1]))
-
-        def anySquaresInCheck():
-          length = abs(relPos[0 if relPos[0] != 0 else 1])
-          for i in range(1, int(length)+1):
-            square = (i/length * relPos[0] + self.boardPosition[0], i/length * relPos[1] + self.boardPosition[1])
-            if inCheck(square, self.side):
-              return True
-          return False
-
-        if self.castleRook != None:
-          castleMovement = (not self.castleRook.moved) and (not self.moved) and (not anySquaresInCheck()) and emptyPath(self, self.relativeBoardPos(self.castleRook.boardPosition)) and not inCheck(self.boardPosition, self.side)
-
-        else:
-          castleMovement = False
-      else:
-        castleMovement = False
-
-      return normalMovement or castleMovement
+    pieceType = rules.KING
 
     def move(self, pos):
-      try:
-        if self.castleRook != None:
-          self.castleRook.boardPosition = ((self.boardPosition[0]+pos[0])/2, self.castleRook.boardPosition[1])
-      except AttributeError:
-        pass
+      relPos = self.relativeBoardPos(pos)
+      if abs(relPos[0]) == 2:
+        castleRook = self.game.squares.get(([None, 7, 0][int(relPos[0]/abs(relPos[0]))], self.boardPosition[1]))
+        rookPos = ((self.boardPosition[0]+pos[0])//2, castleRook.boardPosition[1])
+        self.game.historyStep.record('move', castleRook, castleRook.square, boardPosToSquare(rookPos))
 
       super().move(pos)
 
@@ -455,87 +558,40 @@ class King(Piece):
       return "King"
 
 class Pawn(Piece):
-    def _canMoveTo(self, pos, relPos, **kwargs):
-      dir = self.side.moveDirection
-      square = self.game.squares.get(pos)
-      if pos == self.game.enPassant:
-        square = True
-
-      if square == None:
-        if self.boardPosition[1] == [None, 6, 1][dir]:
-          return (relPos == (0, -1 * dir)) or (relPos == (0, -2 * dir))
-        else:
-          return relPos == (0, -1 * dir)
-      else:
-        return (abs(relPos[0]) == 1) and (relPos[1] == -1 * dir)
+    pieceType = rules.PAWN
 
     def name(self):
       return "Pawn"
 
     def move(self, pos):
-      self._oldPos = self.boardPosition
+      if self.game.position.isEnPassant(self.legalMove(pos)):
+        capture(self.game.squares[(pos[0], self.boardPosition[1])])
 
       super().move(pos)
 
-    def onMoveTo(self, pos):
-      if abs(pos[1]-self._oldPos[1]) == 2:
-        self.game.enPassant = (pos[0], (pos[1]+self._oldPos[1])/2)
-
-      if pos[1] == [None, 0, 7][self.side.moveDirection]:
+    def onMoveTo(self, move):
+      if rules.movePromotion(move):
         game.promotionPawn = self
+        game.promotionMove = rules.encodeMove(rules.moveFrom(move), rules.moveTo(move))
 
         game.updateHistory()
 
       else:
 
-        postMove()
+        super().onMoveTo(move)
 
 #endregion
 
-STARTING_POSITIONS = {
-    Color.BLACK: {
-        Rook: [(0, 0), (7, 0)],
-        Knight: [(1, 0), (6, 0)],
-        Bishop: [(2, 0), (5, 0)],
-        Queen: [(3, 0)],
-        King: [(4, 0)],
-        Pawn: [(i, 1) for i in range(8)]
-    },
-    Color.WHITE: {
-        Rook: [(0, 7), (7, 7)],
-        Knight: [(1, 7), (6, 7)],
-        Bishop: [(2, 7), (5, 7)],
-        Queen: [(3, 7)],
-        King: [(4, 7)],
-        Pawn: [(i, 6) for i in range(8)]
-    }
-}
+PIECE_CLASSES = {c.pieceType: c for c in [Pawn, Knight, Bishop, Rook, Queen, King]}
 
 #region UI
 
-pygame.font.init()
-
 #spaceToFlipText = 'Press space to flip the board'
 #promotionText = "Type Q, K, R, or B to promote your pawn (Queen, Knight, Rook, Bishop)"
 #topTipText = Text(spaceToFlipText, 'Assets/Fonts/Montserrat/Montserrat-Regular.ttf', 16, colorToRgb(Color.BLACK), True)
 #topTip = GameObject(topTipText.render())
 #centerTopTip()
 
-selectionOutline = GameObject(pygame.image.load(os.path.join('Assets', 'Selection Outline.png')), size=squareSize())
-
-redClick = GameObject(pygame.Color(255, 0, 0), size=squareSize())
-redClick.surface.set_alpha(0)
-
-gameOverText = Text("{} Wins", 'Assets/Fonts/Montserrat/Montserrat-Bold.ttf', 40, colorToRgb(Color.BLACK), True)
-gameOverTextObj = None
-
-promotionText = Text(
-  "Type Q, K, R, or B to promote your pawn (Queen, Knight, Rook, Bishop)",
-  'Assets/Fonts/Montserrat/Montserrat-Medium.ttf',
-  18, colorToRgb(Color.BLACK), True
-)
-promotionTextObj = None
-
 def restartGame():
   if undoButton.inGame:
     undoButton.remove(game)
@@ -544,19 +600,54 @@ def restartGame():
   game.clock.remove()
   game.init()
 
+def loadFen(fen):
+  # Starts a new game from a position, restarting goes back to it. A bad FEN raises ValueError
+  # before anything is changed.
+  rules.Position.fromFen(fen)
+  game.startFen = fen
+  restartGame()
+
 def undo():
   game.historyIndex += 1
 
 def redo():
   game.historyIndex -= 1
 
-restartButton = Button((80, 40), (WIN_SIZE[0]-80, 0), Text("Restart", 'Assets/Fonts/Montserrat/Montserrat-Regular.ttf', 14, (0, 0, 0), True).render(), (255, 255, 255), (255, 0, 0), (175, 0, 0), restartGame)
-undoButton = Button((40, 40), (0, 0), pygame.transform.scale(pygame.image.load('Assets/Undo Arrow.png'), (25, 25)), (255, 255, 255), (210, 210, 210), (150, 150, 150), undo)
-redoButton = Button((40, 40), (40, 0), pygame.transform.flip(pygame.transform.scale(pygame.image.load('Assets/Undo Arrow.png'), (25, 25)), True, False), (255, 255, 255), (210, 210, 210), (150, 150, 150), redo)
+# Made for every new game instead of at import, so nothing is loaded until a game is wanted and
+# games don't share state
+def createUI():
+  global selectionOutline, redClick, gameOverText, gameOverTextObj, promotionText, promotionTextObj, restartButton, undoButton, redoButton
 
-#endregion
+  pygame.font.init()
+
+  selectionOutline = GameObject(loadImage(os.path.join('Assets', 'Selection Outline.png')), size=squareSize())
+
+  redClick = GameObject(pygame.Color(255, 0, 0), size=squareSize())
+  redClick.surface.set_alpha(0)
+
+  # Marks on the squares the selected piece can move to, a dot or a ring around a piece it can take
+  global moveDot, captureRing
+  size = squareSize()
+  moveDot = pygame.Surface(size, pygame.SRCALPHA)
+  pygame.draw.circle(moveDot, (0, 0, 0, 70), (size[0]/2, size[1]/2), size[0]/6)
+  captureRing = pygame.Surface(size, pygame.SRCALPHA)
+  pygame.draw.circle(captureRing, (0, 0, 0, 70), (size[0]/2, size[1]/2), size[0]/2 - 2, int(size[0]/12))
+
+  gameOverText = Text("{} Wins", 'Assets/Fonts/Montserrat/Montserrat-Bold.ttf', 40, colorToRgb(Color.BLACK), True)
+  gameOverTextObj = None
+
+  promotionText = Text(
+    "Type Q, K, R, or B to promote your pawn (Queen, Knight, Rook, Bishop)",
+    'Assets/Fonts/Montserrat/Montserrat-Medium.ttf',
+    18, colorToRgb(Color.BLACK), True
+  )
+  promotionTextObj = None
 
-game = Chess()
+  restartButton = Button((80, 40), (WIN_SIZE[0]-80, 0), Text("Restart", 'Assets/Fonts/Montserrat/Montserrat-Regular.ttf', 14, (0, 0, 0), True).render(), (255, 255, 255), (255, 0, 0), (175, 0, 0), restartGame)
+  undoButton = Button((40, 40), (0, 0), loadImage('Assets/Undo Arrow.png', (25, 25)), (255, 255, 255), (210, 210, 210), (150, 150, 150), undo)
+  redoButton = Button((40, 40), (40, 0), pygame.transform.flip(loadImage('Assets/Undo Arrow.png', (25, 25)), True, False), (255, 255, 255), (210, 210, 210), (150, 150, 150), redo)
+
+#endregion
 
 #region Main Game Logic
 
@@ -564,23 +655,44 @@ def promoteTo(pieceType):
   if game.promotionPawn == None:
     return
 
+  move = game.promotionMove
+  game.historyStep.record('push', rules.encodeMove(rules.moveFrom(move), rules.moveTo(move), pieceType.pieceType))
+
   newPiece = pieceType(game.promotionPawn.side, game.promotionPawn.boardPosition, game)
-  game.removeGameObject(game.promotionPawn)
-  game.addGameObject(newPiece)
+  game.historyStep.record('promote', game.promotionPawn, newPiece, game.promotionPawn.square)
   game.promotionPawn = None
+  game.promotionMove = None
 
   postMove()
 
 def changeSelection(piece):
   if piece == None:
-    game.removeGameObject(selectionOutline)
+    if game.selectedPiece != None:
+      game.removeGameObject(selectionOutline)
   else:
     selectionOutline.position = piece.position
     if game.selectedPiece == None:
         game.addGameObject(selectionOutline)
   game.selectedPiece = piece
+  updateMoveHighlights()
+
+def updateMoveHighlights():
+  for highlight in game.moveHighlights:
+    game.removeGameObject(highlight)
+  game.moveHighlights = []
+
+  if game.selectedPiece == None:
+    return
+  for boardPos in game.legalMoves.get(game.selectedPiece.boardPosition, ()):
+    surface = captureRing if boardPos in game.squares else moveDot
+    highlight = GameObject(surface, size=squareSize(), position=boardToPixelPos(boardPos))
+    game.addGameObject(highlight, HIGHLIGHT_LAYER)
+    game.moveHighlights.append(highlight)
 
 def postMove():
+  game.clock.moveMade()
+  game.logMove()
+  game.invalidateLegalMoves()
   game.currentSide = otherSide()
 
   game.backgroundColor = colorToRgb(game.currentSide.color)
@@ -593,9 +705,36 @@ def postMove():
   if game.settings['autoFlip']:
     flipBoard()
 
-@game.event(pygame.MOUSEBUTTONDOWN)
+  if engineToMove(game):
+    game.runAfterWait(playEngineMove, 0)
+
+def engineToMove(game):
+  return game.currentSide.color.name.lower() in game.settings['engineSides']
+
+def playEngineMove():
+  if game.gameOver or game.clock.timeOut or (game.promotionPawn != None) or not engineToMove(game):
+    return
+
+  if game.book != None:
+    move = game.book.choose(game.position)
+    if move != None:
+      onEngineMove(move)
+      return
+
+  remaining = game.clock.time[int(game.currentSide.color)] if game.clock.enabled else None
+  game.searchWorker.start(game.position.copy(), engine.moveTime(remaining, game.settings['engineMoveTime']), onEngineMove)
+
+def onEngineMove(move):
+  # Plays the engine's move through the pieces, the same way clicks would
+  if (move == None) or game.gameOver or game.clock.timeOut:
+    return
+
+  game.squares[squareToBoardPos(rules.moveFrom(move))].move(squareToBoardPos(rules.moveTo(move)))
+  if rules.movePromotion(move):
+    promoteTo(PIECE_CLASSES[rules.movePromotion(move)])
+
 def onMouseDown(data):
-    if (data['button'] != 1) or game.gameOver:
+    if (data['button'] != 1) or game.gameOver or game.searchWorker.thinking:
       return
 
     if game.promotionPawn == None:
@@ -619,7 +758,6 @@ def onMouseDown(data):
           redClick.surface.set_alpha(200)
           redClick.fadeTo(0, 15)
 
-@game.event(pygame.KEYDOWN)
 def onKeyDown(data):
   if (data['unicode'] == ' ') and not game.flippingBoard:
     flipBoard()
@@ -654,39 +792,47 @@ def flipBoard():
   for side in game.sides:
     side.moveDirection = -side.moveDirection
 
+  game.invalidateLegalMoves()
+  updateMoveHighlights()
   game.flippingBoard = False
 
+def onQuit(data):
+  if game.moveLog != None:
+    game.moveLog.close()
+
+def endLoadedGame():
+  game.gameOver = True
+
 def endGameCheck():
-  for p in game.currentSide.pieces:
-    for row in range(8):
-      for column in range(8):
-        sqr = game.squares.get((row, column))
-        if sqr != None:
-          if sqr.color == game.currentSide.color:
-            continue
-
-        if p.canMoveTo((row, column)):
-          return False
-  return True
+  # Checkmate or stalemate, read off the legal moves the next clicks need anyway
+  return not game.legalMoves
   
 def capture(piece):
   side = game.sides[abs(int(piece.color)-1)]
+  capPieceGameObject = capturedPieceObject(piece.name(), piece.color, side)
 
-  game.removeGameObject(piece)
+  game.historyStep.record('capture', piece, piece.square, capPieceGameObject, side)
 
-  size = capturedPieceSquareSize()
-  capPieceGameObject = GameObject(piece.surface, size=(size, size), position=(len(side.capturedPieces)*size + CAPTURED_PIECE_PADDING, capturedPieceRows()[int(piece.color)]))
-  game.addGameObject(capPieceGameObject)
+#endregion
 
-  side.capturedPieces[type(piece)] = capPieceGameObject # might not type()
-  side._capturedPiecesPositions[capPieceGameObject.position] = capPieceGameObject
+#region Game
 
-#endregion
+def newGame(**options):
+  # Options are passed on to Chess and Game, e.g. headless=True to play scripted games without a
+  # window, or gameLog to log the game to a file and resume it from there
+  global game
+
+  createUI()
+  game = Chess(**options)
 
-#region Buttons
+  game.event(pygame.MOUSEBUTTONDOWN)(onMouseDown)
+  game.event(pygame.KEYDOWN)(onKeyDown)
+  game.event(pygame.QUIT)(onQuit)
+  game.addButtons([restartButton])
 
-game.addButtons([restartButton])
+  return game
 
 #endregion
 
-game.start()
\ No newline at end of file
+if __name__ == '__main__':
+  newGame(gameLog=GAME_LOG).start()
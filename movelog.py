@@ -0,0 +1,137 @@
+import os
+import struct
+import time
+
+import rules
+
+# Append-only log of a game, so it survives a crash or a closed window. The file starts with
+# the position the game started from and then has one record per event:
+#   MOVE      a move and both clocks after it, in milliseconds
+#   TAKEBACK  the last n moves were taken back (undone, then replaced by another move)
+# Records are only ever added, so a crash can at worst cut off the last one, which reading skips.
+MAGIC = b'CML1'
+FEN_LENGTH = struct.Struct('>H')
+RECORD = struct.Struct('>BHII')
+
+MOVE = 1
+TAKEBACK = 2
+
+class MoveLog:
+    # How long written records may wait before they are forced to disk, in seconds
+    SYNC_INTERVAL = 1.0
+
+    def __init__(self, path, fen=None, clock=time.monotonic):
+        # Starts a new log at path for a game from fen (the usual start if None), replacing any
+        # log there. Use MoveLog.resume to carry on an existing one.
+        self.path = path
+        self.plies = 0
+        self._clock = clock
+        self._file = None
+        if fen != None:
+            self._open('wb')
+            fen = fen.encode()
+            self._file.write(MAGIC + FEN_LENGTH.pack(len(fen)) + fen)
+            self.sync()
+
+    def _open(self, mode):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, mode)
+        self._dirty = False
+        self._lastSync = self._clock()
+
+    @classmethod
+    def resume(cls, path, plies, clock=time.monotonic):
+        # Log that appends to the one at path, after the plies moves read from it. Anything torn
+        # off the end by a crash is cut first, so new records follow the last whole one.
+        log = cls(path, clock=clock)
+        log.plies = plies
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            f.seek(len(MAGIC))
+            headerSize = len(MAGIC) + FEN_LENGTH.size + FEN_LENGTH.unpack(f.read(FEN_LENGTH.size))[0]
+        wholeSize = headerSize + (size - headerSize) // RECORD.size * RECORD.size
+        if wholeSize != size:
+            os.truncate(path, wholeSize)
+        log._open('ab')
+        return log
+
+    def append(self, move, times):
+        # times are the clocks of white and black in seconds
+        self._write(MOVE, move, times)
+        self.plies += 1
+
+    def takeBack(self, plies):
+        self._write(TAKEBACK, plies, (0, 0))
+        self.plies -= plies
+
+    def _write(self, kind, value, times):
+        self._file.write(RECORD.pack(kind, value, *(max(0, round(t * 1000)) for t in times)))
+        self._dirty = True
+        if self.timeUntilSync() == 0:
+            self.sync()
+
+    def timeUntilSync(self):
+        # Seconds until written records should go to disk, None if there are none
+        if not self._dirty:
+            return None
+        return max(0, self._lastSync + self.SYNC_INTERVAL - self._clock())
+
+    def sync(self):
+        # Pushes records past Python's and the OS's buffers, so they are on disk
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._dirty = False
+        self._lastSync = self._clock()
+
+    def close(self):
+        if self._file != None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+def read(path):
+    # (start FEN, moves, clocks after the last move in seconds or None) of the log at path, or
+    # None if there is no log. Raises ValueError if the file isn't a whole log. Moves are only
+    # checked against the board by replay.
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    headerSize = len(MAGIC) + FEN_LENGTH.size
+    if (len(data) < headerSize) or (data[:len(MAGIC)] != MAGIC):
+        raise ValueError(f"{path} is not a move log")
+
+    length, = FEN_LENGTH.unpack_from(data, len(MAGIC))
+    if len(data) < headerSize + length:
+        raise ValueError(f"{path} has a cut off header")
+    try:
+        fen = data[headerSize:headerSize + length].decode()
+    except UnicodeDecodeError:
+        raise ValueError(f"{path} has a broken header")
+    offset = headerSize + length
+
+    moves = []
+    times = []
+    for kind, value, whiteTime, blackTime in RECORD.iter_unpack(data[offset:offset + (len(data) - offset) // RECORD.size * RECORD.size]):
+        if kind == MOVE:
+            moves.append(value)
+            times.append((whiteTime / 1000, blackTime / 1000))
+        elif (kind == TAKEBACK) and (value <= len(moves)):
+            del moves[len(moves) - value:]
+            del times[len(times) - value:]
+        else:
+            raise ValueError(f"{path} has a broken record after move {len(moves)}")
+    return fen, moves, times[-1] if times else None
+
+def replay(fen, moves):
+    # Position after the moves. Raises ValueError for a bad FEN or at the first move that isn't
+    # legal on the board.
+    position = rules.Position.fromFen(fen)
+    for move in moves:
+        if move not in position.legalMoves():
+            raise ValueError(f"Move {move} isn't legal in the position {position.toFen()}")
+        position.push(move)
+    return position
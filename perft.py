@@ -0,0 +1,118 @@
+import argparse
+import sys
+import time
+
+import rules
+
+# (name, FEN, leaf node counts from depth 1 upwards)
+REFERENCE_POSITIONS = [
+    ("Starting position", rules.STARTING_FEN, [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603, 193690690]),
+    ("Rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624, 11030083]),
+    ("Promotions and castling", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333, 15833292]),
+    ("Promotions and castling (mirrored)", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1", [6, 264, 9467, 422333, 15833292]),
+    ("Discovered check promotion", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487, 89941194]),
+    ("Middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890, 3894594]),
+    ("Illegal en passant (pinned on the row)", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", [18, 92, 1670, 10138, 185429, 1134888]),
+    ("Illegal en passant (pinned on a diagonal)", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", [13, 102, 1266, 10276, 135655, 1015133]),
+    ("En passant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", [15, 126, 1928, 13931, 206379, 1440467]),
+    ("Short castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", [15, 66, 1198, 6399, 120330, 661072]),
+    ("Long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", [16, 71, 1286, 7418, 141077, 803711]),
+    ("Castling rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", [26, 1141, 27826, 1274206]),
+    ("Castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", [44, 1494, 50509, 1720476]),
+    ("Promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", [11, 133, 1442, 19174, 266199, 3821001]),
+    ("Discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", [29, 165, 5160, 31961, 1004658]),
+    ("Promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", [9, 40, 472, 2661, 38983, 217342, 3742283]),
+    ("Underpromote to give check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", [6, 27, 273, 1329, 18135, 92683, 1555980]),
+    ("Self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", [2, 6, 13, 63, 382, 2217, 15453]),
+    ("Stalemate and checkmate (pawn)", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", [10, 25, 268, 926, 10857, 43261, 567584]),
+    ("Stalemate and checkmate (pieces)", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", [37, 183, 6559, 23527, 811573]),
+]
+
+def perft(position, depth):
+    if depth == 0:
+        return 1
+
+    moves = position.legalMoves()
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        position.push(move)
+        nodes += perft(position, depth - 1)
+        position.pop()
+    return nodes
+
+def divide(position, depth):
+    counts = {}
+    for move in position.legalMoves():
+        position.push(move)
+        counts[rules.moveName(move)] = perft(position, depth - 1)
+        position.pop()
+    return counts
+
+def _rate(nodes, seconds):
+    return int(nodes / seconds) if seconds > 0 else 0
+
+def run(fen, depth, expected=None, output=print):
+    position = rules.Position.fromFen(fen)
+    passed = True
+    totalNodes, totalTime = 0, 0
+
+    for d in range(1, depth + 1):
+        start = time.perf_counter()
+        nodes = perft(position, d)
+        seconds = time.perf_counter() - start
+        totalNodes += nodes
+        totalTime += seconds
+
+        line = f"  depth {d}: {nodes} nodes in {seconds:.3f}s ({_rate(nodes, seconds)} nodes/s)"
+        if expected != None and d <= len(expected):
+            if nodes == expected[d-1]:
+                line += " ok"
+            else:
+                line += f" FAILED (expected {expected[d-1]})"
+                passed = False
+        output(line)
+
+    return passed, totalNodes, totalTime
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Count leaf nodes of the legal move tree to benchmark and check the move generator")
+    parser.add_argument('--fen', help="position to search instead of the reference suite")
+    parser.add_argument('--depth', type=int, default=3, help="maximum depth (default: 3)")
+    parser.add_argument('--divide', action='store_true', help="print the node count below each root move of --fen")
+    options = parser.parse_args(args)
+
+    if options.fen != None:
+        if options.divide:
+            counts = divide(rules.Position.fromFen(options.fen), options.depth)
+            for name, nodes in sorted(counts.items()):
+                print(f"{name}: {nodes}")
+            print(f"Total: {sum(counts.values())}")
+            return 0
+
+        print(options.fen)
+        run(options.fen, options.depth)
+        return 0
+
+    failures = []
+    suiteNodes, suiteTime = 0, 0
+    for name, fen, expected in REFERENCE_POSITIONS:
+        print(f"{name}: {fen}")
+        passed, nodes, seconds = run(fen, min(options.depth, len(expected)), expected)
+        suiteNodes += nodes
+        suiteTime += seconds
+        if not passed:
+            failures.append(name)
+
+    print(f"{suiteNodes} nodes in {suiteTime:.3f}s ({_rate(suiteNodes, suiteTime)} nodes/s)")
+    if failures:
+        print(f"{len(failures)} position(s) failed: {', '.join(failures)}")
+        return 1
+    print(f"All {len(REFERENCE_POSITIONS)} positions passed")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
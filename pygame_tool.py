@@ -1,7 +1,8 @@
 import pygame
 from typing import Union
 from enum import Enum
-import time
+from collections import OrderedDict
+import math
 
 def transform(surface, **kwargs):
     rotation = kwargs.get('rotation')
@@ -17,6 +18,20 @@ def transform(surface, **kwargs):
 
     return surface
 
+_imageCache = {}
+
+def loadImage(path, size=None):
+    # Images are loaded and scaled once per process and the same surface is handed out after that
+    key = (path, None if size == None else tuple(size))
+    surface = _imageCache.get(key)
+    if surface == None:
+        if size == None:
+            surface = pygame.image.load(path)
+        else:
+            surface = pygame.transform.scale(loadImage(path), size)
+        _imageCache[key] = surface
+    return surface
+
 class SizeNotGivenError(Exception):
     pass
 
@@ -51,6 +66,7 @@ class GameObject:
         self.lastPos = position
 
         self._fade = None
+        self.layer = 0
 
     #region transform()
 
@@ -110,7 +126,10 @@ class GameObject:
     @size.setter
     def size(self, new_size):
         #self._size = new_size
-        self._surface = pygame.transform.scale(self._originalSurface, new_size)
+        if self._originalSurface.get_size() == tuple(new_size):
+            self._surface = self._originalSurface
+        else:
+            self._surface = pygame.transform.scale(self._originalSurface, new_size)
 
     @rotation.setter
     def rotation(self, new_rotation):
@@ -169,7 +188,21 @@ class GameObject:
 
     #endregion
 
+_fontCache = {}
+
+def loadFont(path, size):
+    key = (path, size)
+    font = _fontCache.get(key)
+    if font == None:
+        font = _fontCache[key] = pygame.font.Font(path, size)
+    return font
+
 class Text:
+    RENDER_CACHE_SIZE = 256
+
+    # Rendered surfaces shared by every Text, least recently used first
+    _renderCache = OrderedDict()
+
     def __init__(self, text, fontPath, size, color, antialias):
         self.text = text
         self.size = size
@@ -177,19 +210,27 @@ class Text:
         self.color = color
         self.antialias = antialias
 
-        self._fontPath = fontPath
-
     @property
     def font(self):
-        return self._font
+        return loadFont(self._fontPath, self.size)
     
     @font.setter
     def font(self, path):
-        self._font = pygame.font.Font(path, self.size)
+        self._fontPath = path
 
     def render(self):
-        self.font = self._fontPath
-        return self.font.render(self.text, self.antialias, self.color)
+        key = (self._fontPath, self.size, self.text, tuple(self.color), self.antialias)
+        cache = Text._renderCache
+
+        surface = cache.get(key)
+        if surface != None:
+            cache.move_to_end(key)
+            return surface
+
+        surface = cache[key] = self.font.render(self.text, self.antialias, self.color)
+        if len(cache) > Text.RENDER_CACHE_SIZE:
+            cache.popitem(last=False)
+        return surface
 
 class ButtonMode(Enum):
     PRESS = 0
@@ -319,14 +360,28 @@ class Button:
         #     self._updateBackground((100, 100, 100))
 
 class Game:
-    def __init__(self, size, **options): # fps=60, backgroundColor=(0, 0, 0), windowTitle=None, gravityScale=.3
+    def __init__(self, size, **options): # fps=60, backgroundColor=(0, 0, 0), windowTitle=None, gravityScale=.3, dirtyRects=True, eventDriven=False, headless=False, draw=True
         self.size = size
         self.fps = options.get('fps', 60)
         self.backgroundColor = options.get('backgroundColor', (0, 0, 0))
         self.windowTitle = options.get('windowTitle')
         self.gravityScale = options.get('gravityScale', .3)
+        # Only redraw the parts of the window that changed since the last frame, set to False to
+        # redraw everything every frame
+        self.dirtyRects = options.get('dirtyRects', True)
+        # Sleep until an event arrives or something has to update instead of ticking at fps,
+        # for games that sit still most of the time
+        self.eventDriven = options.get('eventDriven', False)
+        # Run without a window: frames are drawn to an off-screen surface, time only moves when
+        # step() is called and events come from postEvent()
+        self.headless = options.get('headless', False)
+        # Set to False to skip drawing altogether, for headless games nobody looks at
+        self.draw = options.get('draw', True)
+        # The window, made by open(). Headless games draw off-screen and can step without it.
+        self.win = pygame.Surface(size) if self.headless else None
 
         self._updateCallbacks = []
+        self._deadlineCallbacks = []
         # I should do lists for other callbacks too
         self._touchCallback = None
         self._collideCallback = None
@@ -335,51 +390,143 @@ class Game:
         self._gameObjects = []
         self._deltaTime = 0
         self._waits = {}
+        self._ticks = 0
+        self._postedEvents = []
+
+        self._renderedObjects = {}
+        self._renderedBackground = None
+        self._fullRedraw = True
+        self._layerSurfaces = {}
 
         self._BASE_FRAMERATE = 60
+        self.COLLISION_CELL_SIZE = 64
 
     @property
     def deltaTime(self):
         return float(self._deltaTime)
 
+    def getTicks(self):
+        # Milliseconds since the game started, on the virtual clock when headless
+        return self._ticks if self.headless else pygame.time.get_ticks()
+
     def runAfterWait(self, callback, duration):
-        self._waits[callback] = [time.time(), duration]
-    
+        self._waits[callback] = [self.getTicks() / 1000, duration]
+
+    def postEvent(self, eventType, **attributes):
+        # Handled with the next frame's events as if pygame had sent it
+        self._postedEvents.append(pygame.event.Event(eventType, **attributes))
+
+    def open(self):
+        if not self.headless:
+            if self.windowTitle:
+                pygame.display.set_caption(self.windowTitle)
+            self.win = pygame.display.set_mode(self.size)
+        self.invalidate()
+
     def start(self):
-        if self.windowTitle:
-            pygame.display.set_caption(self.windowTitle)
-        self.win = pygame.display.set_mode(self.size)
+        self.open()
+
+        if self.headless:
+            while self.step():
+                pass
+            return
 
         clock = pygame.time.Clock()
         lastFrameTicks = 0
 
         running = True
         while running:
+            events = []
+            idle = False
+            if self.eventDriven and not self._postedEvents:
+                timeout = self._timeUntilUpdate()
+                if (timeout == None) or (timeout > 0):
+                    idle = True
+                    event = pygame.event.wait() if timeout == None else pygame.event.wait(math.ceil(timeout * 1000))
+                    if event.type != pygame.NOEVENT:
+                        events.append(event)
+
             self._deltaTime = clock.tick(self.fps)
             t = pygame.time.get_ticks()
             self._deltaTime = ((t - lastFrameTicks) / 1000) * self._BASE_FRAMERATE
             lastFrameTicks = t
+            if idle:
+                # Time spent asleep isn't animation time, so the first frame after it is a normal one
+                self._deltaTime = min(self._deltaTime, self._BASE_FRAMERATE / self.fps)
 
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                if (event.type == pygame.KEYDOWN) or (event.type == pygame.KEYUP):
-                    if self._keyEventCallback != None:
-                        self._keyEventCallback(event)
-
-                eventCallbacks = self._events.get(event.type)
-                if eventCallbacks != None:
-                    for c in eventCallbacks:
-                        c(event.__dict__)
-
-            if running:
-                self._update()
+            events.extend(pygame.event.get())
+            running = self._frame(events)
             
         pygame.quit()
 
+    def step(self, milliseconds=None):
+        # Runs one headless frame after moving the virtual clock on by milliseconds, or by one frame
+        # if not given. Event driven games skip ahead to their next deadline instead. Returns False
+        # once a QUIT event was handled or nothing is left that could ever change the game.
+        idle = False
+        if milliseconds == None:
+            milliseconds = 1000 / self.fps
+            if self.eventDriven and not self._postedEvents:
+                timeout = self._timeUntilUpdate()
+                if timeout == None:
+                    return False
+                if timeout > 0:
+                    idle = True
+                    milliseconds = timeout * 1000
+
+        self._ticks += milliseconds
+        self._deltaTime = (milliseconds / 1000) * self._BASE_FRAMERATE
+        if idle:
+            self._deltaTime = min(self._deltaTime, self._BASE_FRAMERATE / self.fps)
+
+        return self._frame([])
+
+    def _frame(self, events):
+        events = self._postedEvents + events
+        self._postedEvents = []
+
+        running = True
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+            if (event.type == pygame.KEYDOWN) or (event.type == pygame.KEYUP):
+                if self._keyEventCallback != None:
+                    self._keyEventCallback(event)
+
+            eventCallbacks = self._events.get(event.type)
+            if eventCallbacks != None:
+                for c in eventCallbacks:
+                    c(event.__dict__)
+
+        if running:
+            self._update()
+        return running
+
     def update(self, callback):
         self._updateCallbacks.append(callback)
 
+    def deadline(self, callback):
+        # The callback returns the seconds until it next needs an update, or None if it doesn't
+        # need one. Only used when eventDriven is on.
+        self._deadlineCallbacks.append(callback)
+
+    def _animating(self):
+        for gObj in self._gameObjects:
+            if gObj._fade or gObj.gravity or gObj.velocity != (0, 0):
+                return True
+        return False
+
+    def _timeUntilUpdate(self):
+        if self._animating():
+            return 0
+
+        timeouts = [v[0] + v[1] - self.getTicks() / 1000 for v in self._waits.values()]
+        for c in self._deadlineCallbacks:
+            timeout = c()
+            if timeout != None:
+                timeouts.append(timeout)
+        return min(timeouts) if timeouts else None
+
     def event(self, eventType):
         def _event(callback):
             if self._events.get(eventType) != None:
@@ -400,8 +547,14 @@ class Game:
     def gObjCollide(self, callback):
         self._collideCallback = callback
 
-    def addGameObject(self, gameObject):
-        self._gameObjects.append(gameObject)
+    def addGameObject(self, gameObject, layer=None):
+        # Objects are drawn by layer from low to high, and in the order they were added within a layer
+        if layer != None:
+            gameObject.layer = layer
+        index = len(self._gameObjects)
+        while index > 0 and self._gameObjects[index-1].layer > gameObject.layer:
+            index -= 1
+        self._gameObjects.insert(index, gameObject)
         return gameObject
 
     def removeGameObject(self, gameObject):
@@ -420,76 +573,197 @@ class Game:
         for c in self._updateCallbacks:
             c()
 
-        self.win.fill(self.backgroundColor)
-
         #region GameObjects
 
-        for gObj1 in self._gameObjects:
+        for gObj in self._gameObjects:
 
-            if gObj1.gravity:
-                gObj1.yVelocity += self.gravityScale * gObj1.mass
+            if gObj.gravity:
+                gObj.yVelocity += self.gravityScale * gObj.mass
 
-            gObj1.position = (
-                gObj1.xPos + gObj1.xVelocity * self.deltaTime, 
-                gObj1.yPos + gObj1.yVelocity * self.deltaTime
+            gObj.position = (
+                gObj.xPos + gObj.xVelocity * self.deltaTime, 
+                gObj.yPos + gObj.yVelocity * self.deltaTime
             )
 
-            for gObj2 in self._gameObjects:
-                if self._gameObjects.index(gObj2) <= self._gameObjects.index(gObj1):
-                    continue
+        self._updateTouching()
 
-                if gObj1.rect.colliderect(gObj2.rect):
-                    
-                    if (gObj2 not in gObj1._touching) and (gObj1 not in gObj2._touching):
+        for gObj in self._gameObjects:
+            gObj.update(self)
+
+        #endregion
+        
+        #region Waits
+    
+        # Callbacks are taken out before they run so they can wait again
+        for k, v in list(self._waits.items()):
+            if self.getTicks() / 1000 - v[0] >= v[1]:
+                self._waits.pop(k)
+                k()
 
-                        gObj1._touching.append(gObj2)
-                        gObj2._touching.append(gObj1)
+        #endregion
 
-                        if gObj1._touchCallbacks.get(None): gObj1._touchCallbacks[None](gObj2)
-                        if gObj1._touchCallbacks.get(gObj2): gObj1._touchCallbacks[gObj2]()
-                        
-                        if gObj2._touchCallbacks.get(None): gObj2._touchCallbacks[None](gObj1)
-                        if gObj2._touchCallbacks.get(gObj1): gObj2._touchCallbacks[gObj1]()
+        if self.draw:
+            self._render()
+
+    def _participates(self, gObj):
+        # Objects nothing listens to can't trigger callbacks, so they are only tested against
+        # objects that do
+        if (self._touchCallback != None) or (self._collideCallback != None):
+            return True
+        return bool(gObj._touchCallbacks) or bool(gObj._collideCallbacks) or gObj.collidable
+
+    def _gridCells(self, rect):
+        size = self.COLLISION_CELL_SIZE
+        for x in range(rect.left // size, (rect.right - 1) // size + 1):
+            for y in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield (x, y)
+
+    def _updateTouching(self):
+        participants = [gObj for gObj in self._gameObjects if self._participates(gObj)]
+        if not participants:
+            return
+
+        order = {}
+        rects = {}
+        grid = {}
+        for i, gObj in enumerate(self._gameObjects):
+            order[gObj] = i
+            rects[gObj] = gObj.rect
+            for cell in self._gridCells(rects[gObj]):
+                grid.setdefault(cell, []).append(gObj)
+
+        # Candidate pairs share a grid cell or were touching last frame, so they can stop touching
+        pairs = set()
+        for gObj in participants:
+            candidates = list(gObj._touching)
+            for cell in self._gridCells(rects[gObj]):
+                candidates.extend(grid[cell])
+            for other in candidates:
+                if (other is not gObj) and (other in order):
+                    pairs.add((gObj, other) if order[gObj] < order[other] else (other, gObj))
+
+        for gObj1, gObj2 in sorted(pairs, key=lambda pair: (order[pair[0]], order[pair[1]])):
+            if rects[gObj1].colliderect(rects[gObj2]):
+                
+                if (gObj2 not in gObj1._touching) and (gObj1 not in gObj2._touching):
+
+                    gObj1._touching.append(gObj2)
+                    gObj2._touching.append(gObj1)
+
+                    if gObj1._touchCallbacks.get(None): gObj1._touchCallbacks[None](gObj2)
+                    if gObj1._touchCallbacks.get(gObj2): gObj1._touchCallbacks[gObj2]()
+                    
+                    if gObj2._touchCallbacks.get(None): gObj2._touchCallbacks[None](gObj1)
+                    if gObj2._touchCallbacks.get(gObj1): gObj2._touchCallbacks[gObj1]()
 
-                        if self._touchCallback != None:
-                            self._touchCallback(gObj1, gObj2)
+                    if self._touchCallback != None:
+                        self._touchCallback(gObj1, gObj2)
 
-                        if gObj1.collidable and gObj2.collidable:
+                    if gObj1.collidable and gObj2.collidable:
 
-                            
+                        if gObj1._collideCallbacks.get(None): gObj1._collideCallbacks[None](gObj2)
+                        if gObj1._collideCallbacks.get(gObj2): gObj1._collideCallbacks[gObj2]()
+                        
+                        if gObj2._collideCallbacks.get(None): gObj2._collideCallbacks[None](gObj1)
+                        if gObj2._collideCallbacks.get(gObj1): gObj2._collideCallbacks[gObj1]()
 
-                            if gObj1._collideCallbacks.get(None): gObj1._collideCallbacks[None](gObj2)
-                            if gObj1._collideCallbacks.get(gObj2): gObj1._collideCallbacks[gObj2]()
-                            
-                            if gObj2._collideCallbacks.get(None): gObj2._collideCallbacks[None](gObj1)
-                            if gObj2._collideCallbacks.get(gObj1): gObj2._collideCallbacks[gObj1]()
+                        if self._collideCallback != None:
+                            self._collideCallback(gObj1, gObj2)
 
-                            if self._collideCallback != None:
-                                self._collideCallback(gObj1, gObj2)
+            else:
 
-                else:
+                if (gObj2 in gObj1._touching) and (gObj1 in gObj2._touching):
+                    gObj1._touching.remove(gObj2)
+                    gObj2._touching.remove(gObj1)
+
+    def invalidate(self):
+        self._fullRedraw = True
+
+    def cacheLayer(self, layer):
+        # Draw the layer into one surface that is only redrawn when one of its objects changes,
+        # good for layers that stay the same for many frames
+        self._layerSurfaces[layer] = None
+
+    def _layerSurface(self, layer, members):
+        surface = self._layerSurfaces[layer]
+        if surface == None:
+            surface = pygame.Surface(self.size, pygame.SRCALPHA)
+            for gObj, rect in members:
+                surface.blit(gObj.surface, rect)
+            self._layerSurfaces[layer] = surface
+        return surface
+
+    def _render(self):
+        objects = []
+        rendered = {}
+        dirty = []
+        changedLayers = set()
+        for gObj in self._gameObjects:
+            surface = gObj.surface
+            rect = pygame.Rect(gObj.position, surface.get_size())
+            state = (rect, surface, surface.get_alpha(), gObj.layer)
+            objects.append((gObj, rect))
+
+            # An object is redrawn where it was and where it is now if it moved, changed
+            # surface or faded, and the same goes for objects that were added or removed
+            old = self._renderedObjects.pop(gObj, None)
+            if old == None:
+                dirty.append(rect)
+                changedLayers.add(gObj.layer)
+            elif old[0] != rect or old[1] is not surface or old[2] != state[2] or old[3] != state[3]:
+                dirty.append(old[0])
+                dirty.append(rect)
+                changedLayers.add(old[3])
+                changedLayers.add(gObj.layer)
+            rendered[gObj] = state
+        for old in self._renderedObjects.values():
+            dirty.append(old[0])
+            changedLayers.add(old[3])
+        self._renderedObjects = rendered
+
+        for layer in changedLayers:
+            if layer in self._layerSurfaces:
+                self._layerSurfaces[layer] = None
+
+        # Cached layers are blitted as one surface in place of their objects
+        blits = []
+        index = 0
+        while index < len(objects):
+            layer = objects[index][0].layer
+            if layer in self._layerSurfaces:
+                end = index
+                while end < len(objects) and objects[end][0].layer == layer:
+                    end += 1
+                blits.append((self._layerSurface(layer, objects[index:end]), pygame.Rect((0, 0), self.size)))
+                index = end
+            else:
+                blits.append((objects[index][0].surface, objects[index][1]))
+                index += 1
 
-                    if (gObj2 in gObj1._touching) and (gObj1 in gObj2._touching):
-                        gObj1._touching.remove(gObj2)
-                        gObj2._touching.remove(gObj1)
+        if self.eventDriven and not (dirty or self._fullRedraw or (self.backgroundColor != self._renderedBackground)):
+            return
 
-                        
-            self.win.blit(gObj1.surface, gObj1.position)
+        if (not self.dirtyRects) or self._fullRedraw or (self.backgroundColor != self._renderedBackground):
+            self._fullRedraw = False
+            self._renderedBackground = self.backgroundColor
 
-            gObj1.update(self)
+            self.win.fill(self.backgroundColor)
+            for surface, rect in blits:
+                self.win.blit(surface, rect)
+            if not self.headless:
+                pygame.display.update()
+            return
 
-        #endregion
-        
-        #region Waits
-    
-        waitsCompleted = []
-        for k, v in self._waits.items():
-            if time.time()-v[0] >= v[1]:
-                waitsCompleted.append(k)
-                k()
-        for k in waitsCompleted:
-            self._waits.pop(k)
+        if not dirty:
+            return
 
-        #endregion
+        for area in dirty:
+            self.win.set_clip(area)
+            self.win.fill(self.backgroundColor, area)
+            for surface, rect in blits:
+                if rect.colliderect(area):
+                    self.win.blit(surface, rect)
+        self.win.set_clip(None)
 
-        pygame.display.update()
\ No newline at end of file
+        if not self.headless:
+            pygame.display.update(dirty)
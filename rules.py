@@ -0,0 +1,622 @@
+from enum import IntEnum
+
+from bitboards import *
+from zobrist import PIECE_KEYS, SIDE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS
+
+# Squares are numbered 0-63 row by row from the top left of the unflipped board,
+# so (column, row) board positions map straight onto them: a8 is 0 and h1 is 63
+
+WHITE = 0
+BLACK = 1
+
+PAWN = 0
+KNIGHT = 1
+BISHOP = 2
+ROOK = 3
+QUEEN = 4
+KING = 5
+
+PIECE_NAMES = ['Pawn', 'Knight', 'Bishop', 'Rook', 'Queen', 'King']
+
+FEN_PIECES = 'pnbrqk'
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+PIECES = [[(color, pieceType) for pieceType in range(6)] for color in range(2)]
+
+CASTLE_WHITE_KING = 1
+CASTLE_WHITE_QUEEN = 2
+CASTLE_BLACK_KING = 4
+CASTLE_BLACK_QUEEN = 8
+
+class Status(IntEnum):
+    ONGOING = 0
+    CHECKMATE = 1
+    STALEMATE = 2
+    INSUFFICIENT_MATERIAL = 3
+    FIFTY_MOVES = 4
+    REPETITION = 5
+
+#region Util
+
+def square(column, row):
+    return int(row) * 8 + int(column)
+
+def squareCoords(sq):
+    return (sq % 8, sq // 8)
+
+def squareName(sq):
+    column, row = squareCoords(sq)
+    return 'abcdefgh'[column] + str(8 - row)
+
+def squareFromName(name):
+    return square('abcdefgh'.index(name[0]), 8 - int(name[1]))
+
+def encodeMove(fromSq, toSq, promotion=0):
+    return fromSq | (toSq << 6) | (promotion << 12)
+
+def moveFrom(move):
+    return move & 63
+
+def moveTo(move):
+    return (move >> 6) & 63
+
+def movePromotion(move):
+    return move >> 12
+
+def moveName(move):
+    promotion = movePromotion(move)
+    return squareName(moveFrom(move)) + squareName(moveTo(move)) + (FEN_PIECES[promotion] if promotion else '')
+
+PAWN_STEP = [-8, 8]
+PAWN_START_ROW = [6, 1]
+PROMOTION_ROW = [0, 7]
+
+# (king from, king to, rook from, rook to, squares that must be empty, squares the king crosses or lands on)
+CASTLING_MOVES = {
+    CASTLE_WHITE_KING: (60, 62, 63, 61, bit(61) | bit(62), bit(61) | bit(62)),
+    CASTLE_WHITE_QUEEN: (60, 58, 56, 59, bit(57) | bit(58) | bit(59), bit(58) | bit(59)),
+    CASTLE_BLACK_KING: (4, 6, 7, 5, bit(5) | bit(6), bit(5) | bit(6)),
+    CASTLE_BLACK_QUEEN: (4, 2, 0, 3, bit(1) | bit(2) | bit(3), bit(2) | bit(3)),
+}
+CASTLING_ROOKS = {(c[0], c[1]): (c[2], c[3]) for c in CASTLING_MOVES.values()}
+FEN_CASTLING = {'K': CASTLE_WHITE_KING, 'Q': CASTLE_WHITE_QUEEN, 'k': CASTLE_BLACK_KING, 'q': CASTLE_BLACK_QUEEN}
+CASTLING_RIGHTS = [CASTLE_WHITE_KING | CASTLE_WHITE_QUEEN, CASTLE_BLACK_KING | CASTLE_BLACK_QUEEN]
+
+# Moving a piece from or to one of these squares clears the matching castling rights
+CASTLING_SQUARE_MASKS = {60: 3, 63: CASTLE_WHITE_KING, 56: CASTLE_WHITE_QUEEN, 4: 12, 7: CASTLE_BLACK_KING, 0: CASTLE_BLACK_QUEEN}
+
+#endregion
+
+def _pieceAttacks(sq, piece, occupied):
+    color, pieceType = piece
+    if pieceType == PAWN:
+        return PAWN_ATTACKS[color][sq]
+    if pieceType == KNIGHT:
+        return KNIGHT_ATTACKS[sq]
+    if pieceType == BISHOP:
+        return bishopAttacks(sq, occupied)
+    if pieceType == ROOK:
+        return rookAttacks(sq, occupied)
+    if pieceType == QUEEN:
+        return bishopAttacks(sq, occupied) | rookAttacks(sq, occupied)
+    return KING_ATTACKS[sq]
+
+class Position:
+    def __init__(self):
+        self.board = [None] * 64
+        self.sideToMove = WHITE
+        self.castling = 0
+        self.enPassant = None
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+
+        # One bitboard per (color, piece type), plus the squares occupied by each color
+        self.bitboards = [[0] * 6 for _ in range(2)]
+        self.occupied = [0, 0]
+
+        # Squares attacked by the piece on each square and the union of them per color. Moves
+        # only mark the squares they change, and the attacks touching those squares are
+        # brought up to date the next time a map is needed.
+        self._squareAttacks = [0] * 64
+        self._attackMaps = [0, 0]
+        self._staleAttacks = 0
+
+        # Zobrist hash of the piece placement only, see key for the full position hash
+        self._pieceKey = 0
+
+        self._undo = []
+
+    @classmethod
+    def initial(cls):
+        position = cls()
+        backRank = [ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK]
+        for column in range(8):
+            position.setPiece(square(column, 0), BLACK, backRank[column])
+            position.setPiece(square(column, 1), BLACK, PAWN)
+            position.setPiece(square(column, 6), WHITE, PAWN)
+            position.setPiece(square(column, 7), WHITE, backRank[column])
+        position.castling = CASTLING_RIGHTS[WHITE] | CASTLING_RIGHTS[BLACK]
+        return position
+
+    @classmethod
+    def fromFen(cls, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Invalid FEN: {fen}")
+
+        position = cls()
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN board: {fields[0]}")
+        for row, rowText in enumerate(rows):
+            column = 0
+            for char in rowText:
+                if char in '12345678':
+                    column += int(char)
+                    continue
+                if char.lower() not in FEN_PIECES or column > 7:
+                    raise ValueError(f"Invalid FEN board: {fields[0]}")
+                position.setPiece(square(column, row), WHITE if char.isupper() else BLACK, FEN_PIECES.index(char.lower()))
+                column += 1
+            if column != 8:
+                raise ValueError(f"Invalid FEN board: {fields[0]}")
+        if any(position.board.count((color, KING)) != 1 for color in (WHITE, BLACK)):
+            raise ValueError(f"Invalid FEN board, each side needs one king: {fields[0]}")
+
+        if fields[1] not in ('w', 'b'):
+            raise ValueError(f"Invalid FEN side to move: {fields[1]}")
+        position.sideToMove = WHITE if fields[1] == 'w' else BLACK
+        if fields[2] != '-':
+            for char in fields[2]:
+                if char not in FEN_CASTLING:
+                    raise ValueError(f"Invalid FEN castling rights: {fields[2]}")
+                position.castling |= FEN_CASTLING[char]
+        if fields[3] != '-':
+            if len(fields[3]) != 2 or fields[3][0] not in 'abcdefgh' or fields[3][1] != '63'[position.sideToMove]:
+                raise ValueError(f"Invalid FEN en passant square: {fields[3]}")
+            position.enPassant = squareFromName(fields[3])
+        if len(fields) >= 6:
+            position.halfmoveClock = int(fields[4])
+            position.fullmoveNumber = int(fields[5])
+        return position
+
+    def toFen(self):
+        rows = []
+        for row in range(8):
+            rowText = ''
+            empty = 0
+            for column in range(8):
+                piece = self.board[square(column, row)]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rowText += str(empty)
+                    empty = 0
+                rowText += FEN_PIECES[piece[1]].upper() if piece[0] == WHITE else FEN_PIECES[piece[1]]
+            rows.append(rowText + (str(empty) if empty else ''))
+
+        castling = ''.join(char for char, right in FEN_CASTLING.items() if self.castling & right) or '-'
+        enPassant = squareName(self.enPassant) if self.enPassant != None else '-'
+        return f"{'/'.join(rows)} {'wb'[self.sideToMove]} {castling} {enPassant} {self.halfmoveClock} {self.fullmoveNumber}"
+
+    def copy(self):
+        position = Position()
+        position.board = self.board.copy()
+        position.sideToMove = self.sideToMove
+        position.castling = self.castling
+        position.enPassant = self.enPassant
+        position.halfmoveClock = self.halfmoveClock
+        position.fullmoveNumber = self.fullmoveNumber
+        position.bitboards = [b.copy() for b in self.bitboards]
+        position.occupied = self.occupied.copy()
+        position._squareAttacks = self._squareAttacks.copy()
+        position._attackMaps = self._attackMaps.copy()
+        position._staleAttacks = self._staleAttacks
+        position._pieceKey = self._pieceKey
+        position._undo = self._undo.copy()
+        return position
+
+    #region Board
+
+    def pieceAt(self, sq):
+        return self.board[sq]
+
+    def setPiece(self, sq, color, pieceType):
+        self._removePiece(sq)
+        self._putPiece(sq, color, pieceType)
+        self._staleAttacks |= 1 << sq
+
+    def removePiece(self, sq):
+        piece = self._removePiece(sq)
+        self._staleAttacks |= 1 << sq
+        return piece
+
+    def _putPiece(self, sq, color, pieceType):
+        self.board[sq] = PIECES[color][pieceType]
+        self.bitboards[color][pieceType] |= 1 << sq
+        self.occupied[color] |= 1 << sq
+        self._pieceKey ^= PIECE_KEYS[color][pieceType][sq]
+
+    def _removePiece(self, sq):
+        piece = self.board[sq]
+        if piece is not None:
+            self.board[sq] = None
+            self.bitboards[piece[0]][piece[1]] &= ~(1 << sq)
+            self.occupied[piece[0]] &= ~(1 << sq)
+            self._pieceKey ^= PIECE_KEYS[piece[0]][piece[1]][sq]
+        return piece
+
+    def _movePiece(self, fromSq, toSq):
+        piece = self.board[fromSq]
+        change = (1 << fromSq) | (1 << toSq)
+        self.board[toSq] = piece
+        self.board[fromSq] = None
+        self.bitboards[piece[0]][piece[1]] ^= change
+        self.occupied[piece[0]] ^= change
+        keys = PIECE_KEYS[piece[0]][piece[1]]
+        self._pieceKey ^= keys[fromSq] ^ keys[toSq]
+
+    def kingSquare(self, color):
+        kings = self.bitboards[color][KING]
+        return lowestSquare(kings) if kings else None
+
+    def pieces(self, color=None):
+        return [(sq, p) for sq, p in enumerate(self.board) if p is not None and (color is None or p[0] == color)]
+
+    #endregion
+
+    #region Hashing
+
+    @property
+    def key(self):
+        # Side to move, castling and en passant are cheap to fold in here, so only the piece
+        # placement is updated move by move. The en passant file only counts when a pawn can
+        # actually take, otherwise positions reached by a double step would never repeat.
+        key = self._pieceKey ^ CASTLING_KEYS[self.castling]
+        if self.sideToMove == BLACK:
+            key ^= SIDE_KEY
+        if self.enPassant is not None and PAWN_ATTACKS[1-self.sideToMove][self.enPassant] & self.bitboards[self.sideToMove][PAWN]:
+            key ^= EN_PASSANT_KEYS[self.enPassant % 8]
+        return key
+
+    def repetitions(self):
+        key = self.key
+        count = 1
+        # Only positions since the last capture or pawn move can repeat, and only every other
+        # ply has the same side to move
+        undo = self._undo
+        for i in range(len(undo) - 2, max(len(undo) - self.halfmoveClock, 0) - 1, -2):
+            if undo[i][-1] == key:
+                count += 1
+        return count
+
+    #endregion
+
+    #region Attacks
+
+    def attackersTo(self, sq, byColor, occupied=None):
+        if occupied is None:
+            occupied = self.occupied[0] | self.occupied[1]
+        pieces = self.bitboards[byColor]
+        return ((PAWN_ATTACKS[1-byColor][sq] & pieces[PAWN])
+            | (KNIGHT_ATTACKS[sq] & pieces[KNIGHT])
+            | (KING_ATTACKS[sq] & pieces[KING])
+            | (bishopAttacks(sq, occupied) & (pieces[BISHOP] | pieces[QUEEN]))
+            | (rookAttacks(sq, occupied) & (pieces[ROOK] | pieces[QUEEN])))
+
+    def isAttacked(self, sq, byColor):
+        return (self.attackMap(byColor) >> sq) & 1 == 1
+
+    def attackMap(self, color):
+        if self._staleAttacks:
+            self._updateAttacks(self._staleAttacks)
+        attacked = self._attackMaps[color]
+        if attacked is None:
+            attacked = 0
+            squareAttacks = self._squareAttacks
+            for sq in squares(self.occupied[color]):
+                attacked |= squareAttacks[sq]
+            self._attackMaps[color] = attacked
+        return attacked
+
+    def _updateAttacks(self, changed):
+        board = self.board
+        squareAttacks = self._squareAttacks = self._squareAttacks.copy()
+        occupied = self.occupied[0] | self.occupied[1]
+
+        for sq in squares(changed):
+            piece = board[sq]
+            squareAttacks[sq] = 0 if piece is None else _pieceAttacks(sq, piece, occupied)
+
+        # Sliders only need updating when a changed square lies on one of their rays
+        white, black = self.bitboards
+        sliders = (white[BISHOP] | white[ROOK] | white[QUEEN] | black[BISHOP] | black[ROOK] | black[QUEEN]) & ~changed
+        for sq in squares(sliders):
+            if squareAttacks[sq] & changed:
+                squareAttacks[sq] = _pieceAttacks(sq, board[sq], occupied)
+
+        self._attackMaps = [None, None]
+        self._staleAttacks = 0
+
+    def inCheck(self, color=None):
+        if color is None:
+            color = self.sideToMove
+        kings = self.bitboards[color][KING]
+        return kings != 0 and self.isAttacked(lowestSquare(kings), 1-color)
+
+    #endregion
+
+    #region Move generation
+
+    def legalMoves(self):
+        us = self.sideToMove
+        them = 1 - us
+        ours = self.bitboards[us]
+        own = self.occupied[us]
+        enemy = self.occupied[them]
+        occupied = own | enemy
+        moves = []
+
+        if not ours[KING]:
+            return moves
+        king = lowestSquare(ours[KING])
+
+        danger = self.attackMap(them)
+        checkers = self.attackersTo(king, them, occupied)
+
+        # The king may not step back along the line of a checking slider either, which the
+        # attack map does not cover because the king itself blocks that square
+        theirs = self.bitboards[them]
+        for checker in squares(checkers & ~theirs[PAWN] & ~theirs[KNIGHT]):
+            danger |= LINE[king][checker] & KING_ATTACKS[king] & ~BETWEEN[king][checker] & ~(1 << checker)
+
+        for to in squares(KING_ATTACKS[king] & ~own & ~danger):
+            moves.append(king | (to << 6))
+
+        if checkers & (checkers - 1):
+            return moves
+
+        if checkers:
+            target = BETWEEN[king][lowestSquare(checkers)] | checkers
+        else:
+            target = FULL
+            self._castlingMoves(moves, occupied, danger)
+
+        pinned = 0
+        pinLines = {}
+        snipers = ((rookAttacks(king, 0) & (theirs[ROOK] | theirs[QUEEN]))
+            | (bishopAttacks(king, 0) & (theirs[BISHOP] | theirs[QUEEN])))
+        for sniper in squares(snipers):
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+                pinLines[lowestSquare(blockers)] = LINE[king][sniper]
+
+        quiet = target & ~own
+        for sq in squares(ours[KNIGHT] & ~pinned):
+            for to in squares(KNIGHT_ATTACKS[sq] & quiet):
+                moves.append(sq | (to << 6))
+        for sq in squares(ours[BISHOP] | ours[QUEEN]):
+            allowed = quiet & pinLines.get(sq, FULL)
+            for to in squares(bishopAttacks(sq, occupied) & allowed):
+                moves.append(sq | (to << 6))
+        for sq in squares(ours[ROOK] | ours[QUEEN]):
+            allowed = quiet & pinLines.get(sq, FULL)
+            for to in squares(rookAttacks(sq, occupied) & allowed):
+                moves.append(sq | (to << 6))
+
+        self._pawnMoves(moves, occupied, enemy, target, pinLines)
+        return moves
+
+    def _pawnMoves(self, moves, occupied, enemy, target, pinLines):
+        us = self.sideToMove
+        step = PAWN_STEP[us]
+        promotionRow = ROWS[PROMOTION_ROW[us]]
+        startRow = ROWS[PAWN_START_ROW[us]]
+
+        for sq in squares(self.bitboards[us][PAWN]):
+            allowed = target & pinLines.get(sq, FULL)
+            targets = PAWN_ATTACKS[us][sq] & enemy
+
+            one = sq + step
+            if not occupied & (1 << one):
+                targets |= 1 << one
+                if (1 << sq) & startRow and not occupied & (1 << (one + step)):
+                    targets |= 1 << (one + step)
+            targets &= allowed
+
+            if targets & promotionRow:
+                for to in squares(targets):
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        moves.append(sq | (to << 6) | (promotion << 12))
+            else:
+                for to in squares(targets):
+                    moves.append(sq | (to << 6))
+
+            # En passant can uncover the king along the row of both pawns, which pin
+            # detection misses, so it is checked by playing it
+            if self.enPassant is not None and PAWN_ATTACKS[us][sq] & (1 << self.enPassant):
+                move = sq | (self.enPassant << 6)
+                self.push(move)
+                if not self.inCheck(us):
+                    moves.append(move)
+                self.pop()
+
+    def _castlingMoves(self, moves, occupied, danger):
+        us = self.sideToMove
+        rights = self.castling & CASTLING_RIGHTS[us]
+        if not rights:
+            return
+
+        for right, (kingFrom, kingTo, rookFrom, rookTo, empty, passing) in CASTLING_MOVES.items():
+            if not rights & right:
+                continue
+            if self.board[kingFrom] != PIECES[us][KING] or self.board[rookFrom] != PIECES[us][ROOK]:
+                continue
+            if occupied & empty or danger & passing:
+                continue
+            moves.append(kingFrom | (kingTo << 6))
+
+    def legalMovesFrom(self, sq):
+        return [m for m in self.legalMoves() if moveFrom(m) == sq]
+
+    def findMove(self, fromSq, toSq, promotion=QUEEN):
+        for move in self.legalMovesFrom(fromSq):
+            if moveTo(move) == toSq and movePromotion(move) in (0, promotion):
+                return move
+        return None
+
+    def isLegal(self, move):
+        return move in self.legalMoves()
+
+    def parseSan(self, san):
+        # Legal move written in standard algebraic notation (like Nbd7, exd8=Q+ or O-O), or None
+        # if there isn't exactly one
+        san = san.rstrip('+#!?')
+        if san.replace('0', 'O') in ('O-O', 'O-O-O'):
+            kingFrom = self.kingSquare(self.sideToMove)
+            kingTo = kingFrom + (2 if san.replace('0', 'O') == 'O-O' else -2)
+            return self.findMove(kingFrom, kingTo)
+
+        promotion = 0
+        if san and san[-1] in 'NBRQ':
+            promotion = FEN_PIECES.index(san[-1].lower())
+            san = san[:-1].rstrip('=')
+        if len(san) < 2 or san[-2] not in 'abcdefgh' or san[-1] not in '12345678':
+            return None
+        toSq = squareFromName(san[-2:])
+        pieceType = PAWN
+        if san[0] in 'NBRQK':
+            pieceType = FEN_PIECES.index(san[0].lower())
+            san = san[1:]
+        hint = san[:-2].replace('x', '')
+
+        found = None
+        for move in self.legalMoves():
+            fromSq = moveFrom(move)
+            if moveTo(move) != toSq or self.board[fromSq][1] != pieceType or movePromotion(move) != promotion:
+                continue
+            name = squareName(fromSq)
+            if any(c not in name for c in hint):
+                continue
+            if found != None:
+                return None
+            found = move
+        return found
+
+    #endregion
+
+    #region Make/unmake
+
+    def isCapture(self, move):
+        return self.board[moveTo(move)] is not None or self.isEnPassant(move)
+
+    def isEnPassant(self, move):
+        piece = self.board[moveFrom(move)]
+        return piece is not None and piece[1] == PAWN and moveTo(move) == self.enPassant
+
+    def isCastling(self, move):
+        piece = self.board[moveFrom(move)]
+        return piece is not None and piece[1] == KING and abs(moveTo(move) - moveFrom(move)) == 2
+
+    def push(self, move):
+        fromSq, toSq, promotion = move & 63, (move >> 6) & 63, move >> 12
+        piece = self.board[fromSq]
+        color, pieceType = piece
+
+        capturedSq = toSq
+        if pieceType == PAWN and toSq == self.enPassant:
+            capturedSq = toSq - PAWN_STEP[color]
+        captured = self.board[capturedSq]
+
+        self._undo.append((move, captured, capturedSq, self.castling, self.enPassant, self.halfmoveClock, self._squareAttacks, self._attackMaps, self._staleAttacks, self.key))
+
+        changed = (1 << fromSq) | (1 << capturedSq) | (1 << toSq)
+        if captured is not None:
+            self._removePiece(capturedSq)
+        if promotion:
+            self._removePiece(fromSq)
+            self._putPiece(toSq, color, promotion)
+        else:
+            self._movePiece(fromSq, toSq)
+
+        if pieceType == KING and abs(toSq - fromSq) == 2:
+            rookFrom, rookTo = CASTLING_ROOKS[(fromSq, toSq)]
+            self._movePiece(rookFrom, rookTo)
+            changed |= (1 << rookFrom) | (1 << rookTo)
+        self._staleAttacks |= changed
+
+        self.castling &= ~(CASTLING_SQUARE_MASKS.get(fromSq, 0) | CASTLING_SQUARE_MASKS.get(toSq, 0))
+
+        self.enPassant = None
+        if pieceType == PAWN and abs(toSq - fromSq) == 16:
+            self.enPassant = (fromSq + toSq) // 2
+
+        self.halfmoveClock = 0 if (pieceType == PAWN or captured is not None) else self.halfmoveClock + 1
+        if color == BLACK:
+            self.fullmoveNumber += 1
+        self.sideToMove = 1 - color
+
+    def pop(self):
+        move, captured, capturedSq, castling, enPassant, halfmoveClock, squareAttacks, attackMaps, staleAttacks, _ = self._undo.pop()
+        fromSq, toSq, promotion = move & 63, (move >> 6) & 63, move >> 12
+        piece = self.board[toSq]
+        color = piece[0]
+
+        if promotion:
+            self._removePiece(toSq)
+            self._putPiece(fromSq, color, PAWN)
+        else:
+            self._movePiece(toSq, fromSq)
+        if captured is not None:
+            self._putPiece(capturedSq, *captured)
+
+        if piece[1] == KING and abs(toSq - fromSq) == 2:
+            rookFrom, rookTo = CASTLING_ROOKS[(fromSq, toSq)]
+            self._movePiece(rookTo, rookFrom)
+
+        # Attacks from before the move are restored as they were rather than recomputed
+        self._squareAttacks = squareAttacks
+        self._attackMaps = attackMaps
+        self._staleAttacks = staleAttacks
+        self.castling = castling
+        self.enPassant = enPassant
+        self.halfmoveClock = halfmoveClock
+        if color == BLACK:
+            self.fullmoveNumber -= 1
+        self.sideToMove = color
+        return move
+
+    @property
+    def moveStack(self):
+        return [u[0] for u in self._undo]
+
+    #endregion
+
+    #region Game termination
+
+    def insufficientMaterial(self):
+        white, black = self.bitboards
+        if white[PAWN] | white[ROOK] | white[QUEEN] | black[PAWN] | black[ROOK] | black[QUEEN]:
+            return False
+
+        minors = white[KNIGHT] | white[BISHOP] | black[KNIGHT] | black[BISHOP]
+        if popCount(minors) <= 1:
+            return True
+        # Only bishops, all on squares of the same color
+        bishops = white[BISHOP] | black[BISHOP]
+        return minors == bishops and len({sum(squareCoords(sq)) % 2 for sq in squares(bishops)}) == 1
+
+    def status(self):
+        if not self.legalMoves():
+            return Status.CHECKMATE if self.inCheck() else Status.STALEMATE
+        if self.insufficientMaterial():
+            return Status.INSUFFICIENT_MATERIAL
+        if self.halfmoveClock >= 100:
+            return Status.FIFTY_MOVES
+        if self.repetitions() >= 3:
+            return Status.REPETITION
+        return Status.ONGOING
+
+    #endregion
@@ -0,0 +1,597 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+import rules
+from rules import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from bitboards import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, bishopAttacks, rookAttacks, squares, popCount
+
+# Endgame tablebases with the distance to mate of every position of an ending, worked out
+# backwards from the mates (retrograde analysis).
+#
+# An ending is named by its material, stronger side first, like KQvK or KRvKP. The table of an
+# ending has a signed byte for each side to move and each placement of the pieces, from the
+# point of view of the side to move:
+#   0       draw, or a placement that can't happen
+#   n > 0   win, mating in n moves
+#   n < 0   loss, mated after -n-1 more moves of our own (-1 is checkmated)
+# Castling and en passant are left out, as they almost never matter with this little material.
+#
+# Placements are only counted once for all their mirror images: the two kings are one of the
+# pairs left over once touching kings and mirror images are taken out (462 without pawns, where
+# the board can be mirrored and turned 8 ways, 1806 with pawns, which only allow mirroring the
+# files), and the other pieces are base 64 digits (48 for pawns, which can't be on the end
+# rows) in the order of the name. The table file is the bytes compressed a block at a time, so
+# probes only decompress the blocks they need.
+
+MAGIC = b'CTB2'
+EXTENSION = '.tb'
+MAX_PIECES = 4
+
+# Table values per compressed block
+BLOCK_SIZE = 1 << 16
+# Magic, table values and block count, followed by where each block starts and where the last ends
+HEADER = struct.Struct('>4sII')
+
+# Pieces in name order, strongest first
+NAME_PIECES = 'KQRBNP'
+NAME_TYPES = [KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN]
+
+_UNRESOLVED = 0xFF
+
+# Generation flags of a position
+_VALID = 1
+_WIN_EXIT = 2
+_DRAW_EXIT = 4
+_PROCESSED = 8
+
+#region Names
+
+def materialName(pieces):
+    # Name of the ending for (color, type) pieces, white first whichever side is stronger
+    sides = ['', '']
+    for color, pieceType in sorted(pieces, key=lambda piece: NAME_TYPES.index(piece[1])):
+        sides[color] += NAME_PIECES[NAME_TYPES.index(pieceType)]
+    return sides[0] + 'v' + sides[1]
+
+def _strength(side):
+    return tuple(sorted((len(NAME_PIECES) - NAME_PIECES.index(c) for c in side), reverse=True))
+
+def canonicalName(name):
+    # The name with the stronger side first, and whether the colors had to be swapped
+    white, black = name.split('v')
+    if _strength(black) > _strength(white):
+        return black + 'v' + white, True
+    return name, False
+
+def namePieces(name):
+    # (color, type) of each piece in table order
+    white, black = name.split('v')
+    return [(WHITE, NAME_TYPES[NAME_PIECES.index(c)]) for c in white] + [(BLACK, NAME_TYPES[NAME_PIECES.index(c)]) for c in black]
+
+def pliesToMate(value):
+    return 2 * value - 1 if value > 0 else -2 * value - 2
+
+def _pliesToDtm(plies):
+    return (plies + 1) // 2 if plies % 2 else -(plies // 2) - 1
+
+#endregion
+
+#region Generation
+
+def _attacks(sq, pieceType, color, occupied):
+    if pieceType == PAWN:
+        return PAWN_ATTACKS[color][sq]
+    if pieceType == KNIGHT:
+        return KNIGHT_ATTACKS[sq]
+    if pieceType == BISHOP:
+        return bishopAttacks(sq, occupied)
+    if pieceType == ROOK:
+        return rookAttacks(sq, occupied)
+    if pieceType == QUEEN:
+        return bishopAttacks(sq, occupied) | rookAttacks(sq, occupied)
+    return KING_ATTACKS[sq]
+
+# The ways the board can be mirrored and turned, as where each square goes
+_SYMMETRIES = [[(7-r if flipRows else r) * 8 + (7-c if flipFiles else c) for r, c in (((sq % 8, sq // 8) if swap else (sq // 8, sq % 8)) for sq in range(64))]
+               for swap in (False, True) for flipRows in (False, True) for flipFiles in (False, True)]
+# Pawns only move one way, so only the files can be mirrored
+_PAWN_SYMMETRIES = [_SYMMETRIES[0], _SYMMETRIES[1]]
+
+_kingPairCache = {}
+
+def _kingPairs(symmetries):
+    # (white king, black king) of each pair of king squares that can happen, one for each set
+    # of mirror images
+    key = len(symmetries)
+    if key not in _kingPairCache:
+        pairs = []
+        for whiteKing in range(64):
+            for blackKing in range(64):
+                if whiteKing == blackKing or (KING_ATTACKS[whiteKing] >> blackKing) & 1:
+                    continue
+                if min((symmetry[whiteKing], symmetry[blackKing]) for symmetry in symmetries) == (whiteKing, blackKing):
+                    pairs.append((whiteKing, blackKing))
+        _kingPairCache[key] = pairs, {pair: i for i, pair in enumerate(pairs)}
+    return _kingPairCache[key]
+
+class _Ending:
+    # Indexing and move generation over piece squares for one ending
+
+    def __init__(self, name):
+        self.name = name
+        self.pieces = namePieces(name)
+        self.kings = [self.pieces.index((color, KING)) for color in (WHITE, BLACK)]
+        self.others = [i for i, (_, pieceType) in enumerate(self.pieces) if pieceType != KING]
+        self.bases = [48 if self.pieces[i][1] == PAWN else 64 for i in self.others]
+
+        pawns = any(pieceType == PAWN for _, pieceType in self.pieces)
+        self.symmetries = _PAWN_SYMMETRIES if pawns else _SYMMETRIES
+        self.kingPairs, self.kingPairIndex = _kingPairs(self.symmetries)
+        self.size = len(self.kingPairs)
+        for base in self.bases:
+            self.size *= base
+
+        # Runs of pieces of the same kind in others, which are kept sorted by square
+        self.groups = []
+        start = 0
+        for j in range(1, len(self.others) + 1):
+            if j == len(self.others) or self.pieces[self.others[j]] != self.pieces[self.others[start]]:
+                if j - start > 1:
+                    self.groups.append((start, j))
+                start = j
+
+    def index(self, sqs):
+        # Index of the placement out of all its mirror images that comes first, or None when the
+        # kings touch
+        whiteKing, blackKing = sqs[self.kings[WHITE]], sqs[self.kings[BLACK]]
+        best = None
+        for symmetry in self.symmetries:
+            pair = self.kingPairIndex.get((symmetry[whiteKing], symmetry[blackKing]))
+            if pair == None:
+                continue
+            others = [symmetry[sqs[i]] for i in self.others]
+            for start, end in self.groups:
+                others[start:end] = sorted(others[start:end])
+            if best == None or (pair, others) < best:
+                best = (pair, others)
+        if best == None:
+            return None
+
+        index, others = best
+        for sq, base in zip(others, self.bases):
+            index = index * base + (sq - 8 if base == 48 else sq)
+        return index
+
+    def squares(self, index):
+        sqs = [0] * len(self.pieces)
+        for i, base in zip(reversed(self.others), reversed(self.bases)):
+            index, digit = divmod(index, base)
+            sqs[i] = digit + 8 if base == 48 else digit
+        sqs[self.kings[WHITE]], sqs[self.kings[BLACK]] = self.kingPairs[index]
+        return sqs
+
+    def attacked(self, sqs, sq, byColor, occupied, captured=None):
+        for i, (color, pieceType) in enumerate(self.pieces):
+            if color == byColor and i != captured and (_attacks(sqs[i], pieceType, color, occupied) >> sq) & 1:
+                return True
+        return False
+
+    def valid(self, sqs, side):
+        occupied = 0
+        for i, sq in enumerate(sqs):
+            if occupied & (1 << sq):
+                return False
+            occupied |= 1 << sq
+            if self.pieces[i][1] == PAWN and sq // 8 in (0, 7):
+                return False
+        # The side that just moved can't have left its king in check
+        return not self.attacked(sqs, sqs[self.kings[1-side]], side, occupied)
+
+    def moves(self, sqs, side):
+        # Legal moves as (piece, target, captured piece or None, promotion type or None)
+        occupied = 0
+        own = 0
+        for i, sq in enumerate(sqs):
+            occupied |= 1 << sq
+            if self.pieces[i][0] == side:
+                own |= 1 << sq
+        pieceAt = {sq: i for i, sq in enumerate(sqs)}
+
+        moves = []
+        for i, (color, pieceType) in enumerate(self.pieces):
+            if color != side:
+                continue
+            sq = sqs[i]
+            if pieceType == PAWN:
+                targets = PAWN_ATTACKS[color][sq] & occupied & ~own
+                step = rules.PAWN_STEP[color]
+                if not occupied & (1 << (sq + step)):
+                    targets |= 1 << (sq + step)
+                    if sq // 8 == rules.PAWN_START_ROW[color] and not occupied & (1 << (sq + 2 * step)):
+                        targets |= 1 << (sq + 2 * step)
+            else:
+                targets = _attacks(sq, pieceType, color, occupied) & ~own
+
+            for target in squares(targets):
+                captured = pieceAt.get(target)
+                newSqs = sqs.copy()
+                newSqs[i] = target
+                newOccupied = (occupied & ~(1 << sq)) | (1 << target)
+                if self.attacked(newSqs, newSqs[self.kings[side]], 1-side, newOccupied, captured):
+                    continue
+                if pieceType == PAWN and target // 8 == rules.PROMOTION_ROW[color]:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        moves.append((i, target, captured, promotion))
+                else:
+                    moves.append((i, target, captured, None))
+        return moves
+
+    def unmoves(self, sqs, side):
+        # Squares the pieces of the side that just moved could have come from without capturing
+        occupied = 0
+        for sq in sqs:
+            occupied |= 1 << sq
+        mover = 1 - side
+
+        for i, (color, pieceType) in enumerate(self.pieces):
+            if color != mover:
+                continue
+            sq = sqs[i]
+            if pieceType == PAWN:
+                step = rules.PAWN_STEP[color]
+                source = sq - step
+                if 0 <= source < 64 and not occupied & (1 << source) and source // 8 != rules.PROMOTION_ROW[1-color]:
+                    yield i, source
+                    if (source - step) // 8 == rules.PAWN_START_ROW[color] and not occupied & (1 << (source - step)):
+                        yield i, source - step
+            else:
+                for source in squares(_attacks(sq, pieceType, color, occupied) & ~occupied):
+                    yield i, source
+
+def _childName(ending, move):
+    # Ending after a capture or promotion
+    i, _, captured, promotion = move
+    pieces = [piece for j, piece in enumerate(ending.pieces) if j != captured]
+    if promotion != None:
+        pieces[pieces.index(ending.pieces[i])] = (ending.pieces[i][0], promotion)
+    return materialName(pieces)
+
+def generate(name, tablebases, output=print):
+    # Table of ending name as a bytearray. Endings reached by captures and promotions are
+    # probed from tablebases, which needs to have them.
+    ending = _Ending(name)
+    size = ending.size
+    start = time.perf_counter()
+
+    flags = bytearray(2 * size)
+    plies = bytearray([_UNRESOLVED]) * (2 * size)
+    # Longest loss a position can leave the ending into when it can only leave it into losses
+    exitLosses = bytearray(2 * size)
+    # Moves of each position that stay in the ending and haven't been found to lose yet. They
+    # are counted backwards from where they lead, as that is how they are ticked off: a
+    # placement that looks the same from several of its mirror images is reached that many times.
+    counters = array('H', [0]) * (2 * size)
+    # Positions resolved at each ply, still to be processed
+    buckets = {}
+
+    def schedule(position, p):
+        if p >= _UNRESOLVED:
+            raise ValueError(f"{name} has mates too long to store")
+        bucket = buckets.get(p)
+        if bucket == None:
+            bucket = buckets[p] = array('L')
+        bucket.append(position)
+
+    for side in (WHITE, BLACK):
+        for index in range(size):
+            sqs = ending.squares(index)
+            if not ending.valid(sqs, side) or ending.index(sqs) != index:
+                continue
+            position = side * size + index
+            flags[position] |= _VALID
+
+            for i, source in ending.unmoves(sqs, side):
+                previousSqs = sqs.copy()
+                previousSqs[i] = source
+                previous = ending.index(previousSqs)
+                if previous != None:
+                    counters[(1-side) * size + previous] += 1
+
+            moves = ending.moves(sqs, side)
+            count = 0
+            exitWin, exitDraw, exitLoss = None, False, None
+            for move in moves:
+                if move[2] == None and move[3] == None:
+                    count += 1
+                    continue
+
+                value = tablebases.probeSquares(_childName(ending, move), _childPieces(ending, sqs, move), 1-side)
+                if value == 0:
+                    exitDraw = True
+                elif value < 0:
+                    p = pliesToMate(value) + 1
+                    exitWin = p if exitWin == None else min(exitWin, p)
+                else:
+                    p = pliesToMate(value) + 1
+                    exitLoss = p if exitLoss == None else max(exitLoss, p)
+
+            if exitWin != None:
+                flags[position] |= _WIN_EXIT
+                schedule(position, exitWin)
+            elif count == 0:
+                if not moves:
+                    if ending.attacked(sqs, sqs[ending.kings[side]], 1-side, sum(1 << sq for sq in sqs)):
+                        plies[position] = 0
+                        schedule(position, 0)
+                elif not exitDraw:
+                    plies[position] = exitLoss
+                    schedule(position, exitLoss)
+            elif exitDraw:
+                flags[position] |= _DRAW_EXIT
+            elif exitLoss != None:
+                exitLosses[position] = exitLoss
+
+    p = 0
+    while buckets:
+        for position in buckets.pop(p, ()):
+            if plies[position] == _UNRESOLVED:
+                # An exit to a won ending that no move inside the ending beat
+                plies[position] = p
+            if plies[position] != p or flags[position] & _PROCESSED:
+                continue
+            flags[position] |= _PROCESSED
+
+            side, index = divmod(position, size)
+            sqs = ending.squares(index)
+            for i, source in ending.unmoves(sqs, side):
+                previousSqs = sqs.copy()
+                previousSqs[i] = source
+                previous = ending.index(previousSqs)
+                if previous == None:
+                    continue
+                previous += (1-side) * size
+                if not flags[previous] & _VALID or plies[previous] != _UNRESOLVED:
+                    continue
+
+                if p % 2 == 0:
+                    # Moving into a lost position wins
+                    plies[previous] = p + 1
+                    schedule(previous, p + 1)
+                else:
+                    counters[previous] -= 1
+                    # Every move inside the ending loses. A winning exit is already scheduled.
+                    if counters[previous] == 0 and not flags[previous] & (_DRAW_EXIT | _WIN_EXIT):
+                        loss = max(p + 1, exitLosses[previous])
+                        plies[previous] = loss
+                        schedule(previous, loss)
+        p += 1
+
+    table = bytearray(2 * size)
+    for position in range(2 * size):
+        if plies[position] != _UNRESOLVED:
+            table[position] = _pliesToDtm(plies[position]) & 0xFF
+
+    if output != None:
+        output(f"{name}: {time.perf_counter() - start:.1f}s")
+    return table
+
+def _childPieces(ending, sqs, move):
+    i, target, captured, promotion = move
+    pieces = []
+    for j, piece in enumerate(ending.pieces):
+        if j == captured:
+            continue
+        if j == i:
+            piece = (piece[0], promotion if promotion != None else piece[1])
+            pieces.append((piece, target))
+        else:
+            pieces.append((piece, sqs[j]))
+    return pieces
+
+def write(path, table):
+    blocks = [zlib.compress(table[start:start + BLOCK_SIZE], 9) for start in range(0, len(table), BLOCK_SIZE)]
+    offsets = [HEADER.size + 4 * (len(blocks) + 1)]
+    for block in blocks:
+        offsets.append(offsets[-1] + len(block))
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(table), len(blocks)))
+        f.write(struct.pack(f'>{len(offsets)}I', *offsets))
+        for block in blocks:
+            f.write(block)
+
+#endregion
+
+#region Probing
+
+class _CompressedTable:
+    # Values of a table file, mapped into memory and decompressed a block at a time
+    CACHED_BLOCKS = 64
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._data) < HEADER.size:
+            raise ValueError(f"{path} is not a tablebase")
+        magic, self._length, blocks = HEADER.unpack_from(self._data)
+        if magic != MAGIC or len(self._data) < HEADER.size + 4 * (blocks + 1):
+            raise ValueError(f"{path} is not a tablebase")
+        self._offsets = struct.unpack_from(f'>{blocks + 1}I', self._data, HEADER.size)
+        # Decompressed blocks, least recently used first
+        self._blocks = OrderedDict()
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        number, offset = divmod(i, BLOCK_SIZE)
+        block = self._blocks.get(number)
+        if block != None:
+            self._blocks.move_to_end(number)
+            return block[offset]
+
+        block = self._blocks[number] = zlib.decompress(self._data[self._offsets[number]:self._offsets[number + 1]])
+        if len(self._blocks) > self.CACHED_BLOCKS:
+            self._blocks.popitem(last=False)
+        return block[offset]
+
+class Tablebases:
+    def __init__(self, directory=None):
+        # Tables are looked for in directory as <name>.tb and mapped into memory when first
+        # probed. Tables added with add() are used as they are.
+        self.directory = directory
+        self._tables = {}
+        self._endings = {}
+        self.maxPieces = 0
+        if directory != None and os.path.isdir(directory):
+            for fileName in os.listdir(directory):
+                if fileName.endswith(EXTENSION):
+                    name = fileName[:-len(EXTENSION)]
+                    self.maxPieces = max(self.maxPieces, len(name) - 1)
+
+    def add(self, name, table):
+        self._tables[name] = table
+        self.maxPieces = max(self.maxPieces, len(name) - 1)
+
+    def _table(self, name):
+        table = self._tables.get(name)
+        if table == None and self.directory != None:
+            path = os.path.join(self.directory, name + EXTENSION)
+            if not os.path.exists(path):
+                return None
+            table = self._tables[name] = _CompressedTable(path)
+        return table
+
+    def _ending(self, name):
+        ending = self._endings.get(name)
+        if ending == None:
+            ending = self._endings[name] = _Ending(name)
+        return ending
+
+    def has(self, name):
+        name, _ = canonicalName(name)
+        if name.count('K') != 2:
+            return False
+        if name == 'KvK':
+            return True
+        return self._table(name) != None
+
+    def probeSquares(self, name, pieces, side):
+        # Value of the position with ((color, type), square) pieces and side to move, or None
+        # without a table for its ending
+        if name == 'KvK':
+            return 0
+        canonical, flipped = canonicalName(name)
+        table = self._table(canonical)
+        if table == None:
+            return None
+        if flipped:
+            pieces = [((1 - color, pieceType), sq ^ 56) for (color, pieceType), sq in pieces]
+            side = 1 - side
+
+        ending = self._ending(canonical)
+        sqs = []
+        remaining = list(pieces)
+        for piece in ending.pieces:
+            for j, (other, sq) in enumerate(remaining):
+                if other == piece:
+                    sqs.append(sq)
+                    del remaining[j]
+                    break
+        index = ending.index(sqs)
+        if index == None:
+            return 0
+        value = table[side * ending.size + index]
+        return value - 256 if value > 127 else value
+
+    def probe(self, position):
+        # Distance to mate as described at the top, or None if there is no table for the position
+        if popCount(position.occupied[WHITE] | position.occupied[BLACK]) > self.maxPieces:
+            return None
+        pieces = [(piece, sq) for sq, piece in enumerate(position.board) if piece is not None]
+        return self.probeSquares(materialName([piece for piece, _ in pieces]), pieces, position.sideToMove)
+
+    def bestMove(self, position):
+        # The move that keeps the best result the quickest, or None without a table
+        best, bestKey = None, None
+        for move in position.legalMoves():
+            position.push(move)
+            value = self.probe(position)
+            position.pop()
+            if value == None:
+                return None
+            # Mating soonest beats everything, then drawing, then being mated as late as possible
+            key = (2, value) if value < 0 else ((1, 0) if value == 0 else (0, value))
+            if bestKey == None or key > bestKey:
+                best, bestKey = move, key
+        return best
+
+#endregion
+
+def _subEndings(name):
+    # Endings a capture or promotion can lead to, that need tables first
+    pieces = namePieces(name)
+    children = set()
+    for i, (color, pieceType) in enumerate(pieces):
+        if pieceType == KING:
+            continue
+        rest = pieces[:i] + pieces[i+1:]
+        children.add(canonicalName(materialName(rest))[0])
+        if pieceType == PAWN:
+            for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                children.add(canonicalName(materialName(rest + [(color, promotion)]))[0])
+    children.discard('KvK')
+    return children
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generateParser = commands.add_parser('generate', help="generate the tables of endings and the endings they lead to")
+    generateParser.add_argument('endings', nargs='+', help=f"endings like KQvK or KRvKP, up to {MAX_PIECES} pieces")
+    generateParser.add_argument('--directory', default='Tablebases', help="where tables are kept (default: Tablebases)")
+
+    probeParser = commands.add_parser('probe', help="look a position up")
+    probeParser.add_argument('fen', help="position to look up")
+    probeParser.add_argument('--directory', default='Tablebases', help="where tables are kept (default: Tablebases)")
+    options = parser.parse_args(args)
+
+    if options.command == 'probe':
+        tablebases = Tablebases(options.directory)
+        position = rules.Position.fromFen(options.fen)
+        value = tablebases.probe(position)
+        if value == None:
+            print("No table for this position")
+            return 1
+        result = 'Draw' if value == 0 else (f"Mate in {value}" if value > 0 else ("Checkmated" if value == -1 else f"Mated in {-value - 1}"))
+        move = tablebases.bestMove(position)
+        print(result + (f", best move {rules.moveName(move)}" if move != None else ''))
+        return 0
+
+    os.makedirs(options.directory, exist_ok=True)
+    tablebases = Tablebases(options.directory)
+
+    def generateWithSubEndings(name):
+        name, _ = canonicalName(name)
+        if len(name) - 1 > MAX_PIECES or name.count('K') != 2 or not name.startswith('K') or 'vK' not in name:
+            raise ValueError(f"Can't generate {name}")
+        if tablebases.has(name):
+            return
+        for child in sorted(_subEndings(name)):
+            generateWithSubEndings(child)
+        table = generate(name, tablebases)
+        write(os.path.join(options.directory, name + EXTENSION), table)
+        tablebases.add(name, table)
+
+    for name in options.endings:
+        generateWithSubEndings(name)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# Fixed size hash table of search results, packed into 64-bit words so its memory use is
+# known up front
+
+EXACT = 1
+LOWER = 2 # The score is at least this much (the search failed high)
+UPPER = 3 # The score is at most this much (the search failed low)
+
+# Each entry is two words: the data, and the position key xor'd with the data so that an
+# entry written halfway can't be mistaken for a match. Data bits:
+# move 0-15, score 16-36, depth 37-44, bound 45-46, generation 47-52
+SCORE_OFFSET = 1 << 20
+GENERATIONS = 64
+
+ENTRY_WORDS = 2
+# One depth-preferred slot and one always-replace slot
+BUCKET_WORDS = ENTRY_WORDS * 2
+BUCKET_BYTES = BUCKET_WORDS * 8
+
+def _pack(move, score, depth, bound, generation):
+    return (move or 0) | ((score + SCORE_OFFSET) << 16) | (depth << 37) | (bound << 45) | (generation << 47)
+
+def _unpack(data):
+    # (best move, score, depth, bound)
+    return (data & 0xFFFF) or None, ((data >> 16) & 0x1FFFFF) - SCORE_OFFSET, (data >> 37) & 0xFF, (data >> 45) & 3
+
+def tableBytes(megabytes):
+    return max(1, int(megabytes * 1024 * 1024) // BUCKET_BYTES) * BUCKET_BYTES
+
+class TranspositionTable:
+    def __init__(self, megabytes=16, buffer=None):
+        # buffer can be shared memory of tableBytes(megabytes) bytes, like a multiprocessing
+        # RawArray, so that searches in several processes work with one table. Entries are
+        # written without locking, a torn one just fails the key check.
+        self.megabytes = megabytes
+        if buffer == None:
+            buffer = bytearray(tableBytes(megabytes))
+        self._table = memoryview(buffer).cast('B').cast('Q')
+        self._buckets = len(self._table) // BUCKET_WORDS
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        # Misses where the bucket was holding other positions
+        self.collisions = 0
+
+    def newSearch(self):
+        # Entries from older searches give up their depth-preferred slot to anything new
+        self._generation = (self._generation + 1) % GENERATIONS
+
+    def clear(self):
+        table = self._table
+        for i in range(len(table)):
+            table[i] = 0
+        self.resetStats()
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+    def probe(self, key):
+        # (best move, score, depth, bound) stored for the position, or None
+        table = self._table
+        index = (key % self._buckets) * BUCKET_WORDS
+        for slot in (index, index + ENTRY_WORDS):
+            data = table[slot + 1]
+            if data and table[slot] ^ data == key:
+                self.hits += 1
+                return _unpack(data)
+
+        self.misses += 1
+        if table[index + 1] or table[index + ENTRY_WORDS + 1]:
+            self.collisions += 1
+        return None
+
+    def store(self, key, move, score, depth, bound):
+        table = self._table
+        index = (key % self._buckets) * BUCKET_WORDS
+        data = _pack(move, score, depth, bound, self._generation)
+
+        # The first slot keeps the deepest result of the current search, whatever it pushes out
+        # moves to the second slot, which otherwise takes every store that isn't deep enough
+        slot = index + ENTRY_WORDS
+        old = table[index + 1]
+        oldKey = table[index] ^ old
+        if (not old) or (oldKey == key) or (depth >= (old >> 37) & 0xFF) or ((old >> 47) != self._generation):
+            if old and oldKey != key:
+                table[slot] = table[index]
+                table[slot + 1] = old
+            slot = index
+
+        table[slot] = key ^ data
+        table[slot + 1] = data
+
+    def hitRate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0
@@ -0,0 +1,225 @@
+import argparse
+import multiprocessing
+import queue
+import sys
+import time
+
+import engine
+import rules
+import tablebase
+import transposition
+
+# Searches run in their own processes so the game loop keeps drawing and the clock keeps running
+# while the engine thinks. Results come back through a queue that the game polls every frame.
+#
+# With more than one process the search is a lazy SMP one: every process searches the same
+# position with one transposition table in shared memory, and the first process's result is
+# the one played. The others only help by filling the table.
+
+class _Superseded:
+    # Set once the game has cancelled the search, started another one or the main search is done
+    def __init__(self, currentId, searchId):
+        self.currentId = currentId
+        self.searchId = searchId
+
+    def is_set(self):
+        return self.currentId.value != self.searchId
+
+def _run(index, requests, results, currentId, tableMegabytes, tableBuffer, tablebaseDirectory):
+    tablebases = tablebase.Tablebases(tablebaseDirectory) if tablebaseDirectory else None
+    searcher = engine.Engine(transposition.TranspositionTable(tableMegabytes, tableBuffer), helper=index, tablebases=tablebases)
+    while True:
+        request = requests.get()
+        if request == None:
+            return
+
+        searchId, position, seconds = request
+        stop = _Superseded(currentId, searchId)
+        table = searcher.table
+        table.resetStats()
+        if index > 0:
+            searcher.search(position, seconds, stop=stop)
+            results.put(('helped', searchId, searcher.nodes, (table.hits, table.misses, table.collisions)))
+            continue
+
+        def progress(depth, score, move, nodes):
+            results.put(('progress', searchId, depth, score, move, nodes))
+
+        move = searcher.search(position, seconds, stop=stop, progress=progress)
+        with currentId.get_lock():
+            if currentId.value == searchId:
+                currentId.value = 0
+        results.put(('done', searchId, searcher.depth, searcher.score, move, searcher.nodes, (table.hits, table.misses, table.collisions)))
+
+class SearchWorker:
+    # How often the game looks for results while a search is running, in seconds
+    POLL_INTERVAL = 1 / 60
+
+    def __init__(self, game, tableMegabytes=16, processes=1, tablebaseDirectory=None):
+        # Without a game, results are collected by wait() instead of the game loop
+        self.game = game
+        self.tableMegabytes = tableMegabytes
+        self.processes = max(1, processes)
+        self.tablebaseDirectory = tablebaseDirectory
+
+        # Nodes searched and transposition table probes of all processes in the last search,
+        # helpers report theirs after it ended
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+
+        self._processes = []
+        self._searchId = 0
+        self._onDone = None
+        self._onProgress = None
+        self._helpersRunning = 0
+
+        if game != None:
+            game.update(self._poll)
+            game.deadline(self._timeUntilPoll)
+
+    @property
+    def thinking(self):
+        return self._onDone != None
+
+    def start(self, position, seconds, onDone, onProgress=None):
+        # onDone gets the best move (None without legal moves) and onProgress gets
+        # (depth, score, best move, nodes) after each finished depth, both on the game loop
+        self.cancel()
+        if not self._processes:
+            self._startProcesses()
+
+        self._searchId += 1
+        self._currentId.value = self._searchId
+        self._onDone = onDone
+        self._onProgress = onProgress
+        self._helpersRunning = self.processes - 1
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        for requests in self._requests:
+            requests.put((self._searchId, position, seconds))
+
+    def _startProcesses(self):
+        # Spawned rather than forked so the search processes don't inherit the window
+        context = multiprocessing.get_context('spawn')
+        tableBuffer = None
+        if self.processes > 1:
+            tableBuffer = context.RawArray('B', transposition.tableBytes(self.tableMegabytes))
+
+        self._requests = [context.Queue() for _ in range(self.processes)]
+        self._results = context.Queue()
+        self._currentId = context.Value('i', 0)
+        for index in range(self.processes):
+            process = context.Process(target=_run, args=(index, self._requests[index], self._results, self._currentId, self.tableMegabytes, tableBuffer, self.tablebaseDirectory), daemon=True)
+            process.start()
+            self._processes.append(process)
+
+    def cancel(self):
+        # Callbacks of the running search are dropped and the search stops at its next check
+        if not self.thinking:
+            return
+        self._onDone = None
+        self._onProgress = None
+        self._currentId.value = 0
+
+    def wait(self):
+        # Blocks until the search and all its helpers are done
+        while self.thinking or self._helpersRunning > 0:
+            self._poll(block=True)
+
+    def close(self):
+        self.cancel()
+        if self._processes:
+            for requests in self._requests:
+                requests.put(None)
+        for process in self._processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+        if self.game != None:
+            self.game._updateCallbacks.remove(self._poll)
+            self.game._deadlineCallbacks.remove(self._timeUntilPoll)
+
+    def hitRate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0
+
+    def _addStats(self, nodes, stats):
+        self.nodes += nodes
+        hits, misses, collisions = stats
+        self.hits += hits
+        self.misses += misses
+        self.collisions += collisions
+
+    def _timeUntilPoll(self):
+        return self.POLL_INTERVAL if self.thinking else None
+
+    def _poll(self, block=False):
+        while self._processes:
+            try:
+                result = self._results.get(block)
+            except queue.Empty:
+                return
+            block = False
+
+            # Anything from a search that was cancelled or replaced is thrown away
+            kind, searchId = result[0], result[1]
+            if searchId != self._searchId:
+                continue
+
+            if kind == 'helped':
+                self._addStats(result[2], result[3])
+                self._helpersRunning -= 1
+            elif not self.thinking:
+                continue
+            elif kind == 'progress':
+                if self._onProgress != None:
+                    self._onProgress(*result[2:])
+            else:
+                self._addStats(result[5], result[6])
+                onDone = self._onDone
+                self._onDone = None
+                self._onProgress = None
+                onDone(result[4])
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Measure how the engine's search speed scales with the number of processes")
+    parser.add_argument('--fen', default=rules.STARTING_FEN, help="position to search (default: the starting position)")
+    parser.add_argument('--seconds', type=float, default=5, help="time per search (default: 5)")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help="process counts to try (default: 1 2 4)")
+    parser.add_argument('--hash', type=float, default=64, help="transposition table size in MB (default: 64)")
+    options = parser.parse_args(args)
+
+    baseline = None
+    for processes in options.processes:
+        searchWorker = SearchWorker(None, options.hash, processes)
+        result = {}
+        def onProgress(depth, score, move, nodes):
+            result['depth'] = depth
+        def onDone(move):
+            result['move'] = move
+
+        # A short first search starts the processes, so they are all up when the timing starts
+        searchWorker.start(rules.Position.fromFen(options.fen), 0.01, onDone)
+        searchWorker.wait()
+
+        start = time.perf_counter()
+        searchWorker.start(rules.Position.fromFen(options.fen), options.seconds, onDone, onProgress)
+        searchWorker.wait()
+        seconds = time.perf_counter() - start
+        searchWorker.close()
+
+        rate = searchWorker.nodes / seconds
+        if baseline == None:
+            baseline = rate
+        print(f"{processes} process(es): {searchWorker.nodes} nodes in {seconds:.2f}s ({int(rate)} nodes/s, {rate / baseline:.2f}x), depth {result.get('depth', 0)}, best move {rules.moveName(result['move'])}")
+        print(f"    table: {searchWorker.hits} hits, {searchWorker.misses} misses ({searchWorker.collisions} collisions), {searchWorker.hitRate():.1%} hit rate")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,12 @@
+import random
+
+# Fixed seed so keys, and anything stored under them, are the same in every run
+_random = random.Random(0x5EED)
+
+def _key():
+    return _random.getrandbits(64)
+
+PIECE_KEYS = [[[_key() for sq in range(64)] for pieceType in range(6)] for color in range(2)]
+SIDE_KEY = _key()
+CASTLING_KEYS = [_key() for rights in range(16)]
+EN_PASSANT_KEYS = [_key() for column in range(8)]